@@ -0,0 +1,270 @@
+'''
+Columnar CI fixtures of propagate.py, Parquet and Arrow IPC files are detected by
+the file extension.
+
+New columns are added as whole Arrow arrays, nested struct and array paths are
+rebuilt from the child arrays of every level, thus rows are never converted into
+Python dicts. Like the JSON fixtures, missing parents are added as {} or [{}] and
+existing leaves are kept.
+
+pyarrow is an optional dependency, it is only required for columnar fixtures.
+'''
+import os
+import base64
+import logging
+import datetime
+
+import metrics
+import sample_data
+import target_writer
+
+_LOGGER     = logging.getLogger('columnar_fixture.py')
+
+# pyarrow modules, they are imported by require_pyarrow on the first columnar fixture,
+# thus runs without columnar fixtures don't pay the import
+pa = pc = pq = None
+
+# fixture file extension to the columnar format
+COLUMNAR_FORMATS = {
+    ".parquet":     "parquet",
+    ".arrow":       "ipc",
+    ".feather":     "ipc",
+    ".ipc":         "ipc",
+}
+
+
+def columnar_format(fixture_file):
+    """
+    Get the columnar format of a fixture file, None for new line delimited json.
+    >>> columnar_format('a/b.parquet'), columnar_format('a/b.ARROW'), columnar_format('a/b.txt')
+    ('parquet', 'ipc', None)
+    """
+    _, ext = os.path.splitext(fixture_file)
+    return COLUMNAR_FORMATS.get(ext.lower())
+
+def require_pyarrow(fixture_file):
+    global pa, pc, pq
+    if pa is not None:
+        return
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError(f"pyarrow is required to propagate columnar fixture {fixture_file}, "
+                          f"install it by: pip install pyarrow")
+    pa, pc, pq = pyarrow, pyarrow.compute, pyarrow.parquet
+
+def get_arrow_type(spark_type):
+    """
+    Convert spark dataframe type (type string, or array type dict of POD type) to arrow type.
+    """
+    if isinstance(spark_type, dict):
+        assert spark_type.get('type') == 'array' and isinstance(spark_type.get('elementType'), str),\
+            f"Only allowed complex type is array of POD type, but got {spark_type}"
+        return pa.list_(get_arrow_type(spark_type['elementType']))
+    if "boolean" == spark_type:
+        return pa.bool_()
+    elif "byte" == spark_type:
+        return pa.int8()
+    elif "short" == spark_type:
+        return pa.int16()
+    elif "integer" == spark_type:
+        return pa.int32()
+    elif "long" == spark_type:
+        return pa.int64()
+    elif "float" == spark_type:
+        return pa.float32()
+    elif "double" == spark_type:
+        return pa.float64()
+    elif "string" == spark_type:
+        return pa.string()
+    elif "binary" == spark_type:
+        return pa.binary()
+    elif "date" == spark_type:
+        return pa.date32()
+    elif "timestamp" == spark_type:
+        # spark TimestampType is an instant, parquet keeps it as isAdjustedToUTC=true
+        # only for arrow timestamps with a timezone, otherwise it's read as TIMESTAMP_NTZ
+        return pa.timestamp("us", tz="UTC")
+    else:
+        raise ValueError(f"unspported spark type string {spark_type}!")
+
+def arrow_value(value, spark_type):
+    """
+    Convert a sample value in the JSON layout of spark to the python value of its arrow type.
+    >>> arrow_value("2024-02-29T12:34:56.789Z", "timestamp"), arrow_value(["c2FtcGxl"], {"type": "array", "elementType": "binary"})
+    (datetime.datetime(2024, 2, 29, 12, 34, 56, 789000, tzinfo=datetime.timezone.utc), [b'sample'])
+    >>> arrow_value("2024-02-29T20:34:56+08:00", "timestamp") == arrow_value("2024-02-29T12:34:56", "timestamp")
+    True
+    """
+    if value is None:
+        return None
+    if isinstance(spark_type, dict):
+        return [arrow_value(v, spark_type['elementType']) for v in value]
+    if spark_type == "binary" and isinstance(value, str):
+        return base64.b64decode(value)
+    if spark_type == "date" and isinstance(value, str):
+        return datetime.date.fromisoformat(value)
+    if spark_type == "timestamp" and isinstance(value, str):
+        # fromisoformat of python < 3.11 doesn't accept the Z suffix
+        timestamp = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+        # timestamps without offset are taken as UTC, like spark writes them in JSON
+        if timestamp.tzinfo is None:
+            return timestamp.replace(tzinfo=datetime.timezone.utc)
+        return timestamp.astimezone(datetime.timezone.utc)
+    return value
+
+def sample_array(insertion, length, rng):
+    """
+    Draw length samples of the insertion in one call, as an arrow array of its type.
+    The pool values are converted once, then taken by the drawn indexes.
+    """
+    pool = insertion.pool
+    values = pa.array([arrow_value(v, insertion.spark_type) for v in pool.values],
+                      type=get_arrow_type(insertion.spark_type))
+    indexes = sample_data.draw_indexes(pool, length, rng)
+    metrics.count("fields_inserted", length)
+    return values.take(pa.array(indexes, type=pa.int32()))
+
+def single_element_lists(values):
+    """
+    Wrap every value of the array into a list of one element, i.e. [{}] per row.
+    """
+    return pa.ListArray.from_arrays(pa.array(range(len(values) + 1), type=pa.int32()), values)
+
+def insert_columns(names, columns, length, parents, insertion, rng):
+    """
+    Insert the leaf of insertion into the columns of a struct level with length rows.
+    return:
+        The tuple of new names and columns, None if the leaf exists on every path.
+    """
+    if not parents:
+        if insertion.leaf in names:
+            return None
+        return names + [insertion.leaf], columns + [sample_array(insertion, length, rng)]
+
+    (key, is_array), rest = parents[0], parents[1:]
+    if key not in names:
+        child_names, child_columns = insert_columns([], [], length, rest, insertion, rng)
+        child = pa.StructArray.from_arrays(child_columns, names=child_names)
+        if is_array:
+            child = single_element_lists(child)
+        return names + [key], columns + [child]
+
+    i = names.index(key)
+    child = columns[i]
+    if isinstance(child, pa.ChunkedArray):
+        child = child.combine_chunks()
+    child = insert_nested(child, is_array, rest, insertion, rng)
+    if child is None:
+        return None
+    columns = list(columns)
+    columns[i] = child
+    return names, columns
+
+def insert_nested(array, is_array, parents, insertion, rng):
+    """
+    Insert the leaf of insertion into a struct array, or into the struct elements of a
+    list array if is_array is set.
+    return:
+        The new array, None if the leaf exists on every path.
+    """
+    if is_array:
+        if not (pa.types.is_list(array.type) or pa.types.is_large_list(array.type)):
+            raise ValueError(f"Expect list type for {insertion}, but got {array.type}")
+        start = array.offsets[0].as_py()
+        end = array.offsets[-1].as_py()
+        values = insert_nested(array.values.slice(start, end - start), False, parents, insertion, rng)
+        if values is None:
+            return None
+        offsets = pc.subtract(array.offsets, pa.scalar(start, type=array.offsets.type))
+        mask = array.is_null() if array.null_count else None
+        return type(array).from_arrays(offsets, values, mask=mask)
+
+    if not pa.types.is_struct(array.type):
+        raise ValueError(f"Expect struct type for {insertion}, but got {array.type}")
+    fields = {field.name: field for field in array.type}
+    inserted = insert_columns(list(fields), array.flatten(), len(array), parents, insertion, rng)
+    if inserted is None:
+        return None
+    names, columns = inserted
+    new_fields = []
+    for name, column in zip(names, columns):
+        field = fields.get(name)
+        new_fields.append(field if field is not None and field.type == column.type else pa.field(name, column.type))
+    mask = array.is_null() if array.null_count else None
+    return pa.StructArray.from_arrays(columns, fields=new_fields, mask=mask)
+
+def insert_table_columns(table, insertion_plan, is_derived, col_suffix, rng):
+    """
+    Add the new columns of insertion_plan to an arrow table, derived fixtures get
+    top-level "target_name + col_suffix" columns.
+    """
+    for insertion in insertion_plan:
+        if is_derived:
+            insertion = insertion._replace(parents=(), leaf=f"{insertion.target_name}{col_suffix}")
+        inserted = insert_columns(table.column_names, table.columns, table.num_rows, insertion.parents, insertion, rng)
+        if inserted is None:
+            continue
+        names, columns = inserted
+        table = pa.Table.from_arrays(columns, names=names, metadata=table.schema.metadata)
+    return table
+
+def read_table(fixture_file, fmt):
+    # the new content of the fixture in dry run mode
+    content = target_writer.read_bytes(fixture_file)
+    source = pa.BufferReader(content) if content is not None else pa.OSFile(fixture_file, 'rb')
+    with source:
+        if fmt == "parquet":
+            return pq.read_table(source)
+        return pa.ipc.open_file(source).read_all()
+
+def parquet_compression(fixture_file):
+    """
+    Get the compression codec of the first column chunk, so the rewritten file keeps it.
+    """
+    metadata = pq.ParquetFile(fixture_file).metadata
+    if metadata.num_row_groups == 0 or metadata.num_columns == 0:
+        return "snappy"
+    return metadata.row_group(0).column(0).compression.lower()
+
+def write_table_atomic(fixture_file, table, fmt):
+    """
+    Write the arrow table into a temp file in the same directory of fixture_file, then
+    replace fixture_file with it if the content is changed.
+    """
+    fd, tmp_path = target_writer.mkstemp_next_to(fixture_file)
+    os.close(fd)
+    try:
+        if fmt == "parquet":
+            pq.write_table(table, tmp_path, compression=parquet_compression(fixture_file))
+        else:
+            with pa.OSFile(tmp_path, 'wb') as f, pa.ipc.new_file(f, table.schema) as writer:
+                writer.write_table(table)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    target_writer.replace_target(fixture_file, tmp_path)
+
+def apply_columnar_fixture(fixture_file, insertion_plan, is_derived, col_suffix, seed=0):
+    """
+    Add the new columns of insertion_plan to a Parquet or Arrow IPC fixture file.
+    The samples are drawn from one random generator derived from the seed and the
+    fixture file path, the global random state is used if seed is not applied.
+    return:
+        The number of rows.
+    """
+    fmt = columnar_format(fixture_file)
+    require_pyarrow(fixture_file)
+    rng = sample_data.fixture_random(seed, fixture_file)
+    metrics.count("fixture_bytes", os.path.getsize(fixture_file))
+    origin_table = read_table(fixture_file, fmt)
+    table = insert_table_columns(origin_table, insertion_plan, is_derived, col_suffix, rng)
+    if table is origin_table:
+        _LOGGER.info(f"{fixture_file} has all the new columns, leave it alone")
+        metrics.count("files_unchanged")
+    else:
+        write_table_atomic(fixture_file, table, fmt)
+    metrics.count("fixture_lines", table.num_rows)
+    return table.num_rows
@@ -0,0 +1,68 @@
+'''
+Size bounded on-disk caches shared by the automation scripts, e.g. the schema diff
+cache and the yaml snapshots.
+
+Every entry is a file of the cache directory, reading an entry refreshes its mtime,
+and the least recently used entries are evicted once the directory grows beyond its
+size limit.
+'''
+import os
+import logging
+
+_LOGGER     = logging.getLogger('disk_cache.py')
+
+# every entry takes at least one file system block, even the empty markers
+MIN_ENTRY_SIZE = 4096
+
+
+def touch(path):
+    """
+    Refresh the mtime of a cache entry for the least recently used eviction.
+    """
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        # evicted by a concurrent run
+        pass
+
+def evict(cache_dir, max_bytes, suffixes):
+    """
+    Remove least recently used cache entries, the files of cache_dir ending with one of
+    suffixes, until the cache size is within max_bytes.
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as cache_dir:
+    ...     for i, name in enumerate(["a.entry", "b.entry", "c.other"]):
+    ...         with open(os.path.join(cache_dir, name), 'w') as f:
+    ...             _ = f.write("x")
+    ...         os.utime(os.path.join(cache_dir, name), (i, i))
+    ...     evict(cache_dir, MIN_ENTRY_SIZE, (".entry",))
+    ...     sorted(os.listdir(cache_dir))
+    ['b.entry', 'c.other']
+    """
+    entries = []
+    total = 0
+    try:
+        it = os.scandir(cache_dir)
+    except FileNotFoundError:
+        return
+    with it:
+        for entry in it:
+            if entry.name.endswith(suffixes):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                size = max(stat.st_size, MIN_ENTRY_SIZE)
+                entries.append((stat.st_mtime, size, entry.path))
+                total += size
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        _LOGGER.info(f"Evict cache entry {path}")
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            # evicted by a concurrent run
+            pass
+        total -= size
@@ -0,0 +1,88 @@
+'''
+Read file versions straight from the git object database, the working tree and
+the index are never touched.
+
+Changed files of a revision range are listed by one "git diff", and the blobs of
+any revision are read through one persistent "git cat-file --batch" process.
+'''
+import logging
+import subprocess
+
+_LOGGER     = logging.getLogger('git_blobs.py')
+
+
+def run_git(*args):
+    return subprocess.run(["git", *args], check=True, stdout=subprocess.PIPE).stdout.decode()
+
+def resolve_range(git_range):
+    """
+    Resolve a revision range into the (base, head) revisions to compare, like git diff
+    does: "A...B" compares the merge base of A and B with B, "A..B" compares A with B.
+    An empty side means HEAD.
+    """
+    if "..." in git_range:
+        base, head = git_range.split("...", 1)
+        base, head = base or "HEAD", head or "HEAD"
+        return run_git("merge-base", base, head).strip(), head
+    if ".." in git_range:
+        base, head = git_range.split("..", 1)
+        return base or "HEAD", head or "HEAD"
+    raise ValueError(f"Unsupported git range {git_range}, it should be <base>...<head> or <base>..<head>")
+
+def changed_files(base, head, path=None):
+    """
+    List the files changed between base and head under path, deleted files excluded.
+    """
+    args = ["diff", "--name-only", "-z", "--no-renames", "--diff-filter=d", base, head]
+    if path:
+        args.extend(["--", path])
+    return [f for f in run_git(*args).split("\0") if f]
+
+def file_revisions(base, head, path):
+    """
+    List the commits between base and head which changed path, oldest first.
+    """
+    return run_git("log", "--reverse", "--format=%H", f"{base}..{head}", "--", path).split()
+
+
+class BlobReader:
+    """
+    Read blobs by "<revision>:<path>" through one "git cat-file --batch" process, use
+    it as a context manager to stop the process.
+    """
+
+    def __init__(self):
+        self.process = subprocess.Popen(["git", "cat-file", "--batch"],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def read(self, revision, path):
+        """
+        Read the content of path at revision.
+        return:
+            The content in bytes, None if path doesn't exist at revision.
+        """
+        self.process.stdin.write(f"{revision}:{path}\n".encode())
+        self.process.stdin.flush()
+        header = self.process.stdout.readline().decode()
+        if not header:
+            raise RuntimeError(f"git cat-file exited unexpectedly while reading {revision}:{path}")
+        parts = header.split()
+        if parts[-1] == "missing":
+            return None
+        if parts[1] != "blob":
+            raise ValueError(f"{revision}:{path} is a {parts[1]}, not a file")
+        size = int(parts[2])
+        content = self.process.stdout.read(size)
+        # the content is followed by a newline
+        self.process.stdout.read(1)
+        return content
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
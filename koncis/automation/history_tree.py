@@ -0,0 +1,188 @@
+'''
+Compact schema tree of schema_history.
+
+A schema version is parsed once into a tree of __slots__ nodes, each type node has a
+NodeKind, so the history walks don't have to probe the raw dicts
+(isinstance(schema['type'], dict), 'elementType' in ... etc.) at every level, and the
+field shells are copied without their children.
+
+    StructType      fields of a struct, the root of a schema is a struct too.
+    ArrayType       an array with its element type.
+    PrimitiveType   a POD type like "long", one shared instance per type name.
+    OtherType       any other type (e.g. map), kept as is.
+    Field           a named field of a struct with its type.
+
+Keys which are not modeled (metadata, nullable, sample_data, target_name ...) and
+the key order of every dict are kept, thus to_yaml gives back the same layout
+that was parsed. Key orders are interned per parsed schema, and the table is dropped
+with it.
+
+The other tools walk the schema dicts directly with schema_tree, building a tree
+costs more than a single walk.
+'''
+import sys
+import enum
+
+_KEY_NAME       = "name"
+_KEY_TYPE       = "type"
+_KEY_FIELDS     = "fields"
+_KEY_ELEMENT    = "elementType"
+
+# type name to the shared PrimitiveType
+_primitives     = {}
+
+
+class NodeKind(enum.Enum):
+    STRUCT      = "struct"
+    ARRAY       = "array"
+    PRIMITIVE   = "primitive"
+    OTHER       = "other"
+
+
+def split_attrs(data, interned, *modeled_keys):
+    """
+    Split a dict into the key order interned in interned and the dict of not modeled
+    keys, None if there are no such keys.
+    >>> interned = {}
+    >>> split_attrs({'a': 1, 'b': 2}, interned, 'a')[0] is split_attrs({'a': 3, 'b': 4}, interned)[0]
+    True
+    """
+    order = tuple(data)
+    order = interned.setdefault(order, order)
+    attrs = {k: v for k, v in data.items() if k not in modeled_keys}
+    return order, attrs or None
+
+
+class PrimitiveType:
+    __slots__ = ("name",)
+    kind = NodeKind.PRIMITIVE
+
+    def __init__(self, name):
+        self.name = name
+
+    def to_yaml(self):
+        return self.name
+
+    def __repr__(self):
+        return f"PrimitiveType({self.name!r})"
+
+
+class OtherType:
+    __slots__ = ("data",)
+    kind = NodeKind.OTHER
+
+    def __init__(self, data):
+        self.data = data
+
+    def to_yaml(self):
+        return self.data
+
+    def __repr__(self):
+        return f"OtherType({self.data!r})"
+
+
+class ArrayType:
+    __slots__ = ("element", "order", "attrs")
+    kind = NodeKind.ARRAY
+
+    def __init__(self, element, order, attrs=None):
+        self.element = element
+        self.order = order
+        self.attrs = attrs
+
+    def with_element(self, element):
+        return ArrayType(element, self.order, self.attrs)
+
+    def to_yaml(self):
+        attrs = self.attrs
+        return {k: self.element.to_yaml() if k == _KEY_ELEMENT else attrs[k] for k in self.order}
+
+    def __repr__(self):
+        return f"ArrayType({self.element!r})"
+
+
+class StructType:
+    __slots__ = ("fields", "order", "attrs")
+    kind = NodeKind.STRUCT
+
+    def __init__(self, fields, order, attrs=None):
+        self.fields = fields
+        self.order = order
+        self.attrs = attrs
+
+    def with_fields(self, fields):
+        return StructType(tuple(fields), self.order, self.attrs)
+
+    def to_yaml(self):
+        attrs = self.attrs
+        return {k: [f.to_yaml() for f in self.fields] if k == _KEY_FIELDS else attrs[k] for k in self.order}
+
+    def __repr__(self):
+        return f"StructType({[f.name for f in self.fields]!r})"
+
+
+class Field:
+    __slots__ = ("name", "type", "order", "attrs")
+
+    def __init__(self, name, type, order, attrs=None):
+        self.name = name
+        self.type = type
+        self.order = order
+        self.attrs = attrs
+
+    def with_type(self, type):
+        return Field(self.name, type, self.order, self.attrs)
+
+    def to_yaml(self):
+        attrs = self.attrs
+        return {k: self.name if k == _KEY_NAME else self.type.to_yaml() if k == _KEY_TYPE else attrs[k]
+                for k in self.order}
+
+    def __repr__(self):
+        return f"Field({self.name!r}, {self.type!r})"
+
+
+def parse_type(data, interned=None):
+    """
+    Parse the type of a field, which is a type string or a type dict. Key orders are
+    interned in interned, a new table if it isn't given.
+    """
+    if isinstance(data, str):
+        primitive = _primitives.get(data)
+        if primitive is None:
+            primitive = _primitives.setdefault(data, PrimitiveType(sys.intern(data)))
+        return primitive
+    if isinstance(data, dict):
+        if interned is None:
+            interned = {}
+        if _KEY_ELEMENT in data:
+            order, attrs = split_attrs(data, interned, _KEY_ELEMENT)
+            return ArrayType(parse_type(data[_KEY_ELEMENT], interned), order, attrs)
+        if data.get(_KEY_TYPE) == NodeKind.STRUCT.value:
+            return parse_struct(data, interned)
+    return OtherType(data)
+
+def parse_struct(data, interned):
+    order, attrs = split_attrs(data, interned, _KEY_FIELDS)
+    fields = []
+    for f in data.get(_KEY_FIELDS, ()):
+        field_order, field_attrs = split_attrs(f, interned, _KEY_NAME, _KEY_TYPE)
+        fields.append(Field(sys.intern(f[_KEY_NAME]), parse_type(f[_KEY_TYPE], interned), field_order, field_attrs))
+    return StructType(tuple(fields), order, attrs)
+
+def parse_schema(data):
+    """
+    Parse a schema loaded from YAML into StructType, None stays None.
+    >>> data = {'type': 'struct', 'fields': [{'name': 'a', 'nullable': True, 'type': 'long'}]}
+    >>> schema = parse_schema(data)
+    >>> schema, schema.fields[0].attrs
+    (StructType(['a']), {'nullable': True})
+    >>> schema.to_yaml() == data and list(schema.to_yaml()) == list(data)
+    True
+    """
+    if data is None:
+        return None
+    return parse_struct(data, {})
+
+def to_yaml(schema):
+    return None if schema is None else schema.to_yaml()
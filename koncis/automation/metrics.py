@@ -0,0 +1,62 @@
+'''
+Timing and counter instrumentation shared by the automation scripts.
+
+Stages record the accumulated wall time of a named block, counters record the
+number of processed lines, bytes, inserted fields, cache hits etc. Hot loops
+should count locally and add the totals once, instead of logging per item.
+'''
+import json
+import time
+import logging
+import contextlib
+from collections import Counter, defaultdict
+
+_LOGGER     = logging.getLogger('metrics.py')
+
+# stage name to accumulated wall time in seconds
+_stages     = defaultdict(float)
+# counter name to value
+_counters   = Counter()
+
+
+def reset():
+    _stages.clear()
+    _counters.clear()
+
+@contextlib.contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _stages[name] += time.perf_counter() - start
+
+def count(name, value=1):
+    _counters[name] += value
+
+def snapshot():
+    """
+    Get the current metrics, which can be passed across processes and merged back.
+    """
+    return {"stages": dict(_stages), "counters": dict(_counters)}
+
+def merge(metrics):
+    for name, seconds in metrics["stages"].items():
+        _stages[name] += seconds
+    _counters.update(metrics["counters"])
+
+def report(timings=False, metrics_out=None):
+    """
+    Log the summary of metrics if timings is set, and write them to metrics_out in
+    JSON if it is given.
+    """
+    metrics = snapshot()
+    if timings:
+        for name, seconds in metrics["stages"].items():
+            _LOGGER.info(f"stage {name}: {seconds:.3f}s")
+        for name, value in sorted(metrics["counters"].items()):
+            _LOGGER.info(f"counter {name}: {value}")
+    if metrics_out:
+        with open(metrics_out, "w") as f:
+            json.dump(metrics, f, indent=2, sort_keys=True)
+            f.write("\n")
@@ -4,126 +4,229 @@ This application will propagate schema changes to given code/fixture files
 
 Usage:
     propagate.py (-h | --help)
-    propagate.py column_spec --diff=<schema_diff_file> <col_file_spec>
-    propagate.py column_tran --diff=<schema_diff_file> <col_trans_file>
-    propagate.py fixture [--seed=<SEED>] --diff=<schema_diff_file> <ci_fixture_file>
-    propagate.py sql_template --diff=<schema_diff_file> <sql_file>
-    propagate.py sql_ddl --diff=<schema_diff_file> [--catalog=<catalog>] <table_spec>
+    propagate.py column_spec [--timings] [--metrics-out=<metrics_file>] [--manifest=<manifest_file>] [--force] [--dry-run] --diff=<schema_diff_file> <col_file_spec>
+    propagate.py column_tran [--timings] [--metrics-out=<metrics_file>] [--manifest=<manifest_file>] [--force] [--dry-run] --diff=<schema_diff_file> <col_trans_file>
+    propagate.py fixture [--timings] [--metrics-out=<metrics_file>] [--seed=<SEED>] [--jobs=<N>] [--manifest=<manifest_file>] [--force] [--dry-run] --diff=<schema_diff_file> <ci_fixture_file>
+    propagate.py sql_template [--timings] [--metrics-out=<metrics_file>] [--manifest=<manifest_file>] [--force] [--dry-run] --diff=<schema_diff_file> <sql_file>
+    propagate.py sql_ddl [--timings] [--metrics-out=<metrics_file>] --diff=<schema_diff_file> [--catalog=<catalog>] [--batched] <table_spec>
+    propagate.py deploy_ddl [--timings] [--metrics-out=<metrics_file>] [--schema-config=<config_file>] [--catalog=<catalog>] [--batched] <schema_diff_spec>...
+    propagate.py plan [--timings] [--metrics-out=<metrics_file>] [--schema-config=<config_file>] [--catalog=<catalog>] [--batched] [--seed=<SEED>] [--jobs=<N>] [--manifest=<manifest_file>] [--force] [--dry-run] --diff=<schema_diff_file> <schema_file>
 
 Options:
     -h, --help                  Print this screen and exit.
-    --diff=<schema_diff_file>   Specify the schema diff file contains new schema fields only.
+    --diff=<schema_diff_file>   Specify the schema diff file contains new schema fields only, in YAML
+                                or spark JSON schema layout.
     --catalog=<catalog>         Specify the catalog name of prod tables.
                                 [default: hive_prod]
+    --batched                   Print one ALTER TABLE ... ADD COLUMNS statement per table, which is
+                                a single Iceberg metadata commit, instead of one statement per column.
     --seed=<SEED>               Specify random seed number for fill fixture data, seed less or equal 0
                                 won't be applied, thus use the default python implementation.
+                                Samples are drawn in batches of lines, each batch gets its own random
+                                generator derived from the seed, the normalized fixture file path and
+                                its first line number, so the output doesn't depend on the number of
+                                jobs or the spelling of the path.
                                 [default: 0]
+    --jobs=<N>                  Specify the number of worker processes for fixture propagation,
+                                fixture files and chunks of large files are spread across them.
+                                [default: 1]
+    --schema-config=<config_file>   Specify the schema config file path
+                                [default: automation/schema_config.yaml]
+    --manifest=<manifest_file>  Specify the propagate manifest file, which records the schema diffs
+                                applied to each target file and its content hash after writing.
+                                Target files whose content and applied schema diff still match it
+                                are skipped. The default file lives in the working tree, thus it
+                                only helps reruns in the same checkout, e.g. local reruns.
+                                [default: .auto/propagate-manifest.json]
+    --force                     Propagate to every target file even if the manifest says it is done.
+    --dry-run                   Don't write any target file or the manifest, print the unified diff
+                                of every target file which would be changed instead.
+    --timings                   Log the wall time of each stage and the counters at last.
+    --metrics-out=<metrics_file>    Write the wall time of each stage and the counters, e.g. processed
+                                lines and bytes, inserted fields and cache hits, to file in JSON.
     <col_file_spec>             Specify the column file path and column name suffix.
     <col_trans_file>            Specify the column transform file.
-    <ci_fixture_file>           Specify the fixture data file path.
+    <ci_fixture_file>           Specify the fixture data file path, new line delimited json, or
+                                Parquet (.parquet) and Arrow IPC (.arrow, .feather, .ipc) files
+                                whose new columns are added as whole arrays, which requires pyarrow.
     <sql_file>                  Specify the SQL template file path.
     <table_spec>                Specify the iceberg table and column suffix.
+    <schema_file>               The schema file path whose content has changed, YAML or spark JSON
+                                schema, all the targets configured for it in schema config file
+                                will be propagated.
+    <schema_diff_spec>          Specify the schema file path and its schema diff file, separated
+                                by ':'. New columns of every given schema are merged per prod table.
 '''
 
 from docopt import docopt
+import io
+import os
 import sys
-import logging
-import random
-
-import yaml
-try:
-    from yaml import CLoader as Loader, CDumper as Dumper
-except ImportError:
-    from yaml import Loader, Dumper
 import json
+import logging
+import re
+import functools
+import itertools
+from collections import namedtuple
+
+import show
+import metrics
+import sample_data
+import schema_tree
+import target_writer
+import columnar_fixture
+import yaml_loader
+from propagate_manifest import PropagateManifest
 
 _LOGGER     = logging.getLogger('propagate.py')
 
+# number of lines of a fixture chunk which is handled by a single worker, chunks are
+# aligned to sample batches so the output doesn't depend on the number of jobs
+FIXTURE_CHUNK_LINES = 50 * sample_data.SAMPLE_BATCH_LINES
+
 
 # util functions
-def pick_random_sample_data(conf):
-    return random.choice(conf["sample_data"])
-
-def add_coba_obj_value(data, keys, value):
-    assert len(keys) > 0, "there should at least 1 key"
-    if len(keys) == 1:
-        currentKey = keys[0]
-        if currentKey.endswith("[]"):
-            currentKey = keys[0][:-2]
-        # won't add new value if current key exists
-        if currentKey not in data:
-            data[currentKey] = value
-    else:
-        currentKey = keys[0]
-        if currentKey.endswith("[]"):
-            currentKey = currentKey[:-2]
-            assert not currentKey.endswith("[]"), "array on array not supported"
-            if currentKey not in data:
-                data[currentKey] = [{}]
-            for d in data[currentKey]:
-                add_coba_obj_value(d, keys[1:], value)
-        else:
-            if currentKey not in data:
-                data[currentKey] = {}
-            add_coba_obj_value(data[currentKey], keys[1:], value)
-
-
-def list_leaf(schema, keys=[]):
-    if isinstance(schema['type'], dict):
-        if 'elementType' in schema['type']:
-            newKeys = keys.copy()
-            newKeys.append(f"{schema['name']}[]")
-            if isinstance(schema['type']['elementType'], dict):
-                assert schema['type']['elementType']['type'] == 'struct', 'array in array type is not supported yet!'
-                results = []
-                for elem in schema['type']['elementType']['fields']:
-                    results.extend(list_leaf(elem, newKeys))
-                return results
-            else:
-                _LOGGER.debug(f"Add leaf {keys}, elementType: {schema['type']['elementType']}")
-                return [(newKeys, schema)]
-        elif 'type' in schema['type'] and 'struct' == schema['type']['type']:
-            newKeys = keys.copy()
-            newKeys.append(f"{schema['name']}")
-            results = []
-            for elem in schema['type']['fields']:
-                results.extend(list_leaf(elem, newKeys))
-            return results
-        else:
-            raise Exception(f"Unsupported schema element type: {schema['type']}!")
-    elif isinstance(schema['type'], str):
-        if 'struct' == schema['type']:
-            results = []
-            for elem in schema['fields']:
-                results.extend(list_leaf(elem, keys))
-            return results
-        else:
-            newKeys = keys.copy()
-            newKeys.append(f"{schema['name']}")
-            _LOGGER.info(f"Add leaf {newKeys}, elementType: {schema['type']}")
-            return [(newKeys, schema)]
-    else:
-        raise Exception(f"Unsupported schema type: {schema['type']}")
+def list_leaf(schema):
+    """
+    List the leaf fields of a schema dict.
+    return:
+        A list of (keys, field), keys are the field names from the top level down to
+        the leaf, the names of array fields are marked by '[]' suffix.
+    >>> diff = {'type': 'struct', 'fields': [
+    ...     {'name': 'a', 'type': {'type': 'array', 'elementType': {'type': 'struct', 'fields': [
+    ...         {'name': 'b', 'type': 'long', 'target_name': 'a_b'}]}}}]}
+    >>> [(keys, field['target_name']) for keys, field in list_leaf(diff)]
+    [(['a[]', 'b'], 'a_b')]
+    """
+    return [([f"{name}[]" if is_array else name for name, is_array in path], field)
+            for path, field in schema_tree.leaves(schema)]
+
 
+# A compiled field insertion of the schema diff, which is shared by every fixture line.
+#   parents:        tuple of (key, is_array) pairs leading to the leaf, '[]' markers resolved.
+#   leaf:           the key to add on the leaf level.
+#   target_name:    the column name for derived fixtures, column suffix not applied.
+#   pool:           the SamplePool of the leaf, its encoded values are used to splice new
+#                   top-level fields into serialized lines.
+#   spark_type:     the spark type of the leaf, a type string or an array type dict, used to
+#                   build the new columns of columnar fixtures.
+FieldInsertion = namedtuple("FieldInsertion", ["parents", "leaf", "target_name", "pool", "spark_type"])
 
-def modify_data(datastr, schema_diff):
+# the last compiled schema diff and its insertion plan, see compile_insertion_plan
+_insertion_plan_cache = (None, ())
+
+def compile_insertion_plan(schema_diff):
+    """
+    Compile the schema diff into an immutable tuple of FieldInsertion, in the order
+    of list_leaf.
+    >>> diff = {'type': 'struct', 'fields': [
+    ...     {'name': 'a', 'type': {'type': 'array', 'elementType': {'type': 'struct', 'fields': [
+    ...         {'name': 'b', 'type': 'long', 'target_name': 'a_b', 'sample_data': [1, 2]}]}}}]}
+    >>> compile_insertion_plan(diff)
+    (FieldInsertion(parents=(('a', True),), leaf='b', target_name='a_b', pool=SamplePool(values=(1, 2), encoded=('1', '2'), cum_weights=None), spark_type='long'),)
+
+    The plan of the last compiled schema diff object is kept, thus a schema diff kept
+    warm by the in-memory yaml cache isn't compiled again.
+    """
+    global _insertion_plan_cache
+    compiled_diff, plan = _insertion_plan_cache
+    if compiled_diff is schema_diff:
+        metrics.count("plan_cache_hits")
+        return plan
+
+    plan = []
+    for path, conf in schema_tree.leaves(schema_diff):
+        pool = sample_data.compile_sample_pool(conf)
+        plan.append(FieldInsertion(path[:-1], conf["name"], conf.get("target_name"), pool, conf["type"]))
+    _LOGGER.info(f"There are {len(plan)} fields to add!")
+    plan = tuple(plan)
+    _insertion_plan_cache = (schema_diff, plan)
+    return plan
+
+def insert_plan_value(data, insertion, value):
+    """
+    Add the value of a compiled FieldInsertion to a fixture object, missing parents are
+    added as {} or [{}], won't add new value if the leaf key exists.
+    return:
+        The number of added values.
+    """
+    nodes = [data]
+    for key, is_array in insertion.parents:
+        children = []
+        for node in nodes:
+            if key not in node:
+                node[key] = [{}] if is_array else {}
+            if is_array:
+                children.extend(node[key])
+            else:
+                children.append(node[key])
+        nodes = children
+    leaf = insertion.leaf
+    inserted = 0
+    for node in nodes:
+        if leaf not in node:
+            node[leaf] = value
+            inserted += 1
+    return inserted
+
+def modify_data(datastr, insertion_plan, indexes):
+    """
+    Add the new fields of insertion_plan to a fixture line, indexes are the drawn
+    sample pool indexes of the line, in the order of insertion_plan.
+    """
     data = json.loads(datastr)
-    result = list_leaf(schema_diff)
-    _LOGGER.info(f"There are {len(result)} fields to add!")
-    for keys, conf in result:
-        value = pick_random_sample_data(conf)
-        add_coba_obj_value(data, keys, value)
+    inserted = 0
+    for insertion, i in zip(insertion_plan, indexes):
+        inserted += insert_plan_value(data, insertion, insertion.pool.values[i])
+    metrics.count("fields_inserted", inserted)
     return json.dumps(data, sort_keys=True, indent=None)
 
-def modify_derived_data(line, schema_diff, col_suffix):
+def derived_fields(insertion_plan, col_suffix):
+    """
+    Get the (key, encoded key prefix) pairs of derived fixture columns, in the order
+    of insertion_plan.
+    """
+    fields = []
+    for insertion in insertion_plan:
+        key = f"{insertion.target_name}{col_suffix}"
+        fields.append((key, f"{json.dumps(key)}: "))
+    return tuple(fields)
+
+def modify_derived_data(line, insertion_plan, derived_keys, indexes):
+    """
+    Add derived columns, which are always top-level, to a fixture line. The line is
+    still parsed to check key presence and serialized as is, but the new fields are
+    spliced into the serialized string from the pre-encoded samples instead of being
+    inserted into the object and encoded again.
+    derived_keys are from derived_fields and indexes are the drawn sample pool indexes
+    of the line, both in the order of insertion_plan.
+    >>> plan = compile_insertion_plan({'type': 'struct', 'fields': [
+    ...     {'name': 'a', 'type': 'long', 'target_name': 'a', 'sample_data': [1]},
+    ...     {'name': 'b', 'type': 'string', 'target_name': 'b', 'sample_data': ["\u00e9"]}]})
+    >>> print(modify_derived_data('{"a": 0, "c": 2}', plan, derived_fields(plan, ''), (0, 0)))
+    {"a": 0, "c": 2, "b": "\\u00e9"}
+    >>> print(modify_derived_data('{}', plan, derived_fields(plan, '_x'), (0, 0)))
+    {"a_x": 1, "b_x": "\\u00e9"}
+    """
     data = json.loads(line)
-    result = list_leaf(schema_diff)
-    _LOGGER.info(f"modify_derived_data: there are {len(result)} fields to add!")
-    for _, conf in result:
-        value = pick_random_sample_data(conf)
-        keys = [f'{conf["target_name"]}{col_suffix}']
-        add_coba_obj_value(data, keys, value)
-    return json.dumps(data, indent=None)
+    if not isinstance(data, dict):
+        # can't splice into non-object lines, let the object path raise the error
+        for insertion, (key, _), i in zip(insertion_plan, derived_keys, indexes):
+            data[key] = insertion.pool.values[i]
+
+    new_fields = []
+    added = set()
+    for insertion, (key, encoded_key), i in zip(insertion_plan, derived_keys, indexes):
+        if key not in data and key not in added:
+            added.add(key)
+            new_fields.append(f"{encoded_key}{insertion.pool.encoded[i]}")
+
+    datastr = json.dumps(data, indent=None)
+    metrics.count("fields_inserted", len(new_fields))
+    if not new_fields:
+        return datastr
+    separator = ", " if len(data) > 0 else ""
+    return f"{datastr[:-1]}{separator}{', '.join(new_fields)}}}"
 
 
 # # functions for change sql files
@@ -170,53 +273,172 @@ def extract_columns_from_sqlddl(ddl):
     winning_bid_adomain array<string>
     >>> print(columns[3])
     bid_price decimal(14, 5)
+    >>> prefix, columns, suffix = extract_columns_from_sqlddl('''CREATE TABLE t (
+    ...     -- comment (with parenthesis, and comma)
+    ...     `a,b` string COMMENT 'x, (y',
+    ...     c int /* d, e) */
+    ... )''')
+    >>> columns
+    ["`a,b` string COMMENT 'x, (y'", 'c int']
     """
-    # find the place of the first '('
-    open_idx = ddl.find('(')
-    if open_idx == -1:
-        raise ValueError("No opening parenthesis found in DDL")
+    open_idx, close_idx, spans = tokenize_sqlddl_columns(ddl)
+    prefix = ddl[:open_idx + 1]
+    columns = [ddl[start:end] for start, end in spans]
+    suffix = ddl[close_idx:]
+    return prefix, columns, suffix
 
-    # find ')' to track ',' level
-    depth = 0
+# tokens of SQL DDL, whitespaces are skipped
+_SQLDDL_TOKEN = re.compile(r"""
+    (?P<comment>--[^\n]*|/\*.*?(?:\*/|\Z))
+  | (?P<quoted>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`)
+  | (?P<punct>[(),])
+  | (?P<word>[^\s(),'"`]+?(?=--|/\*|[\s(),'"`]|\Z)|\S)
+""", re.VERBOSE | re.DOTALL)
+
+@functools.lru_cache(maxsize=64)
+def tokenize_sqlddl_columns(ddl):
+    """
+    Tokenize SQL DDL in one pass to find the column definitions, comments, quoted
+    strings and backticked names are understood.
+    parameters:
+        ddl: SQL DDL in string type
+    return:
+        A tuple of 3 values.
+        open_idx:       The offset of '(' which marks start of column definition.
+        close_idx:      The offset of ')' which marks end of column definition.
+        spans:          A tuple of (start, end) offsets of column definitions, comments
+                        and whitespaces around a column definition are not included.
+    The result is cached per DDL string.
+    >>> tokenize_sqlddl_columns("CREATE TABLE t (a int, b decimal(14, 5)) USING iceberg")
+    (15, 39, ((16, 21), (23, 39)))
+    """
+    open_idx = -1
     close_idx = -1
-    for i, ch in enumerate(ddl[open_idx:], start=open_idx):
-        if ch == '(':
+    depth = 0
+    spans = []
+    col_start = col_end = -1
+    for m in _SQLDDL_TOKEN.finditer(ddl):
+        kind = m.lastgroup
+        if kind == "comment":
+            continue
+        token = m.group()
+        if open_idx == -1:
+            if token == '(':
+                open_idx = m.start()
+                depth = 1
+            continue
+        if token == '(':
             depth += 1
-        elif ch == ')':
+        elif token == ')':
             depth -= 1
             if depth == 0:
-                close_idx = i
+                close_idx = m.start()
                 break
+        elif token == ',' and depth == 1:
+            # depth == 1 to ensure not split in the middle of a column definition for special types
+            # e.g. "bid_price decimal(14, 5)"
+            if col_start >= 0:
+                spans.append((col_start, col_end))
+            col_start = col_end = -1
+            continue
+        if col_start < 0:
+            col_start = m.start()
+        col_end = m.end()
+
+    if open_idx == -1:
+        raise ValueError("No opening parenthesis found in DDL")
     if close_idx == -1:
         raise ValueError("No matching closing parenthesis found in DDL")
-
-    # split to prefix, columns_str, suffix
-    prefix = ddl[:open_idx + 1]
-    columns_str = ddl[open_idx + 1:close_idx]
-    suffix = ddl[close_idx:]
-
-    # extract columns by the top ','
-    columns = []
-    buffer = []
-    depth = 0
-    for ch in columns_str:
-        if ch == '(':
-            depth += 1
-        elif ch == ')':
-            depth -= 1
-        # depth == 0 to ensure not split in the middle of a column definition for special types
-        # e.g. "bid_price decimal(14, 5)"
-        if ch == ',' and depth == 0:
-            columns.append(''.join(buffer).strip())
-            buffer = []
-        else:
-            buffer.append(ch)
     # Add the last column
-    last_col = ''.join(buffer).strip()
-    if last_col:
-        columns.append(last_col)
+    if col_start >= 0:
+        spans.append((col_start, col_end))
+    return open_idx, close_idx, tuple(spans)
 
-    return prefix, columns, suffix
+def sql_column_name(column):
+    return column.split(maxsplit=1)[0].strip("`")
+
+def splice_sqlddl_columns(ddl, new_columns, before="txn_time"):
+    """
+    Insert new column definitions before the column named before, or after the last
+    column if it doesn't exist. The rest of the DDL is kept byte by byte, comments on
+    their own lines above the column named before and the trailing comment of the last
+    column stay with their columns.
+    >>> print(splice_sqlddl_columns('''CREATE TABLE t (
+    ...   a int, -- keep me
+    ...   txn_time timestamp
+    ... )''', ["b string", "c long"]))
+    CREATE TABLE t (
+      a int, -- keep me
+      b string,
+      c long,
+      txn_time timestamp
+    )
+    >>> print(splice_sqlddl_columns('''CREATE TABLE t (
+    ...   a int, -- a note
+    ...   -- event time
+    ...   txn_time timestamp
+    ... )''', ["x long"]))
+    CREATE TABLE t (
+      a int, -- a note
+      x long,
+      -- event time
+      txn_time timestamp
+    )
+    >>> print(splice_sqlddl_columns('''CREATE TABLE t (
+    ...   a int,
+    ...   b string -- b note
+    ... )''', ["x long", "y int"]))
+    CREATE TABLE t (
+      a int,
+      b string, -- b note
+      x long,
+      y int
+    )
+    """
+    if not new_columns:
+        return ddl
+    open_idx, close_idx, spans = tokenize_sqlddl_columns(ddl)
+    if not spans:
+        columns_str = ",\n    ".join(new_columns)
+        return f"{ddl[:open_idx + 1]}\n    {columns_str}\n{ddl[close_idx:]}"
+
+    def line_start_of(offset):
+        return ddl.rfind("\n", 0, offset) + 1
+
+    def indent_of(start):
+        indent = ddl[line_start_of(start):start]
+        return indent if not indent.strip() else "    "
+
+    prev_end = open_idx + 1
+    for start, end in spans:
+        if sql_column_name(ddl[start:end]) == before:
+            indent = indent_of(start)
+            if ddl[line_start_of(start):start].strip():
+                # the column doesn't start a line, e.g. single line DDL
+                inserted = "".join(f"{col},\n{indent}" for col in new_columns)
+                return f"{ddl[:start]}{inserted}{ddl[start:]}"
+            # insert above the comments on their own lines which lead the column
+            insert_at = line_start_of(start)
+            for m in _SQLDDL_TOKEN.finditer(ddl, prev_end, start):
+                if m.lastgroup == "comment" and not ddl[line_start_of(m.start()):m.start()].strip():
+                    insert_at = line_start_of(m.start())
+                    break
+            inserted = "".join(f"{indent}{col},\n" for col in new_columns)
+            return f"{ddl[:insert_at]}{inserted}{ddl[insert_at:]}"
+        prev_end = end
+
+    last_start, last_end = spans[-1]
+    indent = indent_of(last_start)
+    # new columns go after the comments on the same line of the last column
+    insert_at = last_end
+    for m in _SQLDDL_TOKEN.finditer(ddl, last_end, close_idx):
+        if m.lastgroup != "comment" or "\n" in ddl[insert_at:m.start()]:
+            break
+        insert_at = m.end()
+    inserted = "".join(f",\n{indent}{col}" for col in new_columns)
+    if insert_at == last_end:
+        return f"{ddl[:last_end]}{inserted}{ddl[last_end:]}"
+    return f"{ddl[:last_end]},{ddl[last_end:insert_at]}{inserted[1:]}{ddl[insert_at:]}"
 
 def is_schema_simple_array(conf):
     return "elementType" in conf and isinstance(conf["elementType"], str) and conf["elementType"] != "struct"
@@ -259,87 +481,362 @@ def get_sql_type(conf):
 
 
 # wrapper functions
-def modify_fixture(fixture_spec, schema_diff_file, seed):
-    # we only support new line delimited json data as ci fixture
-    if seed > 0:
-        random.seed(seed)
-
-    with open(schema_diff_file) as sf:
-        schema_diff = yaml.safe_load(sf)
+def load_schema_diff(schema_diff_file):
+    with metrics.stage("load_schema_diff"):
+        return yaml_loader.load_yaml(schema_diff_file)
 
+def parse_fixture_spec(fixture_spec):
     specs = fixture_spec.split(":")
     fixture_file = specs[0]
     is_derived = (specs[1] == "derived")
     col_suffix = specs[2]
-    lines = []
-    with open(fixture_file) as f:
-        for l in f:
+    return fixture_file, is_derived, col_suffix
+
+def modified_fixture_lines(fixture_file, lines, insertion_plan, is_derived, col_suffix, seed, first_line_no=0):
+    """
+    Modify fixture lines batch by batch, the samples of a batch are drawn at once by a
+    random generator of its first line. first_line_no must be aligned to batches.
+    """
+    derived_keys = derived_fields(insertion_plan, col_suffix)
+    pools = [insertion.pool for insertion in insertion_plan]
+    lines = iter(lines)
+    line_no = first_line_no
+    while True:
+        batch = list(itertools.islice(lines, sample_data.SAMPLE_BATCH_LINES))
+        if not batch:
+            break
+        rows = sample_data.draw_rows(pools, len(batch), sample_data.fixture_random(seed, fixture_file, line_no))
+        line_no += len(batch)
+        for l, indexes in zip(batch, rows):
             if not is_derived:
-                lines.append(f"{modify_data(l, schema_diff)}\n")
+                yield f"{modify_data(l, insertion_plan, indexes)}\n"
             else:
-                lines.append(f"{modify_derived_data(l, schema_diff, col_suffix)}\n")
+                yield f"{modify_derived_data(l, insertion_plan, derived_keys, indexes)}\n"
+
+def apply_fixture(fixture_spec, insertion_plan, seed=0):
+    # ci fixture is new line delimited json data, or columnar data detected by extension
+    fixture_file, is_derived, col_suffix = parse_fixture_spec(fixture_spec)
+    if columnar_fixture.columnar_format(fixture_file):
+        count = columnar_fixture.apply_columnar_fixture(fixture_file, insertion_plan, is_derived, col_suffix, seed)
+        _LOGGER.info(f"Totally {count} fixture rows are modified!")
+        return
+    metrics.count("fixture_bytes", os.path.getsize(fixture_file))
+    with target_writer.open_text(fixture_file) as f:
+        lines = modified_fixture_lines(fixture_file, f, insertion_plan, is_derived, col_suffix, seed)
+        count = target_writer.write_lines(fixture_file, lines)
+    metrics.count("fixture_lines", count)
+    _LOGGER.info(f"Totally {count} fixture data are modified!")
+
+def split_fixture_chunks(fixture_file, chunk_lines):
+    """
+    Split the fixture file into chunks of at most chunk_lines lines.
+    return:
+        A list of (start_offset, end_offset, first_line_no) tuples, offsets are in bytes.
+    """
+    chunks = []
+    start, offset, line_no, first_line_no = 0, 0, 0, 0
+    with open(fixture_file, 'rb') as f:
+        for l in f:
+            offset += len(l)
+            line_no += 1
+            if line_no - first_line_no == chunk_lines:
+                chunks.append((start, offset, first_line_no))
+                start, first_line_no = offset, line_no
+    if offset > start:
+        chunks.append((start, offset, first_line_no))
+    return chunks
+
+def propagate_fixture_chunk(fixture_spec, insertion_plan, seed, chunk):
+    """
+    Worker function of the parallel fixture propagation, which writes the modified
+    lines of a fixture chunk into a temp file next to the fixture file.
+    return:
+        The tuple of temp file path, the number of modified lines and the metrics of
+        the chunk.
+    """
+    # worker processes are reused, only report the metrics of this chunk
+    metrics.reset()
+    fixture_file, is_derived, col_suffix = parse_fixture_spec(fixture_spec)
+    start, end, first_line_no = chunk
+    with open(fixture_file, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    # decode with the same universal newline handling as the serial version
+    lines = io.TextIOWrapper(io.BytesIO(data))
+    fd, tmp_path = target_writer.mkstemp_next_to(fixture_file, suffix=".chunk")
+    count = 0
+    try:
+        with os.fdopen(fd, 'w') as f:
+            for l in modified_fixture_lines(fixture_file, lines, insertion_plan, is_derived, col_suffix, seed, first_line_no):
+                f.write(l)
+                count += 1
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    metrics.count("fixture_bytes", end - start)
+    metrics.count("fixture_lines", count)
+    return tmp_path, count, metrics.snapshot()
+
+def propagate_columnar_fixture(fixture_spec, insertion_plan, seed):
+    """
+    Worker function of the parallel fixture propagation for columnar fixtures, which
+    are propagated as a whole.
+    return:
+        The tuple of the number of rows and the metrics of the fixture.
+    """
+    metrics.reset()
+    fixture_file, is_derived, col_suffix = parse_fixture_spec(fixture_spec)
+    count = columnar_fixture.apply_columnar_fixture(fixture_file, insertion_plan, is_derived, col_suffix, seed)
+    return count, metrics.snapshot()
 
-    _LOGGER.info(f"Totally {len(lines)} fixture data are modified!")
-    with open(fixture_file, 'w') as f:
-        f.writelines(lines)
+def read_chunk_files(chunk_files):
+    for chunk_file in chunk_files:
+        with open(chunk_file) as f:
+            yield from f
 
-def show_sql_ddl(table_spec, schema_diff_file, catalog):
-    _LOGGER.info(f"Print SQL DDL, table_spec: {table_spec}, schema diff: {schema_diff_file}, catalog: {catalog}")
-    with open(schema_diff_file) as f:
-        schema_diff = yaml.safe_load(f)
+def apply_fixtures(fixture_specs, insertion_plan, seed=0, jobs=1):
+    """
+    Propagate the insertion plan to every fixture, fixture files and chunks of large
+    files are spread across a process pool of jobs workers, the output doesn't depend
+    on jobs when seed is applied. Fixtures are propagated serially in dry run mode.
+    >>> import tempfile
+    >>> plan = compile_insertion_plan({'type': 'struct', 'fields': [{'name': 'a', 'type': 'long'}]})
+    >>> outputs = set()
+    >>> with tempfile.TemporaryDirectory(dir='.') as work_dir:
+    ...     fixture_file = os.path.join(os.path.relpath(work_dir), 'f.txt')
+    ...     for path, jobs in ((fixture_file, 1), (f"./{fixture_file}", 2), (os.path.abspath(fixture_file), 1)):
+    ...         with open(fixture_file, 'w') as f:
+    ...             _ = f.write('{}\\n' * 3)
+    ...         apply_fixtures([f"{path}::"], plan, seed=7, jobs=jobs)
+    ...         outputs.add(open(fixture_file).read())
+    >>> len(outputs)
+    1
+    """
+    if jobs <= 1 or target_writer.is_dry_run():
+        for fixture_spec in fixture_specs:
+            _LOGGER.info(f"propagate fixture {fixture_spec}")
+            apply_fixture(fixture_spec, insertion_plan, seed)
+        return
+
+    # imported lazily, it isn't cheap for the one-off serial runs
+    from concurrent.futures import ProcessPoolExecutor, wait
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {}
+        columnar_futures = {}
+        for fixture_spec in fixture_specs:
+            fixture_file, _, _ = parse_fixture_spec(fixture_spec)
+            if columnar_fixture.columnar_format(fixture_file):
+                _LOGGER.info(f"propagate columnar fixture {fixture_spec}")
+                columnar_futures[fixture_spec] = executor.submit(propagate_columnar_fixture, fixture_spec, insertion_plan, seed)
+                continue
+            chunks = split_fixture_chunks(fixture_file, FIXTURE_CHUNK_LINES)
+            _LOGGER.info(f"propagate fixture {fixture_spec} in {len(chunks)} chunks")
+            futures[fixture_spec] = [executor.submit(propagate_fixture_chunk, fixture_spec, insertion_plan, seed, chunk)
+                                     for chunk in chunks]
+
+        # wait for every chunk before any error is raised, thus the temp files of all
+        # the finished chunks are known and removed
+        chunk_futures = [future for fixture_futures in futures.values() for future in fixture_futures]
+        wait(chunk_futures)
+        chunk_files = [future.result()[0] for future in chunk_futures if future.exception() is None]
+        try:
+            for fixture_spec, fixture_futures in futures.items():
+                fixture_file, _, _ = parse_fixture_spec(fixture_spec)
+                results = [future.result() for future in fixture_futures]
+                for _, _, chunk_metrics in results:
+                    metrics.merge(chunk_metrics)
+                count = target_writer.write_lines(fixture_file, read_chunk_files([tmp_path for tmp_path, _, _ in results]))
+                _LOGGER.info(f"Totally {count} fixture data are modified in {fixture_file}!")
+        finally:
+            for chunk_file in chunk_files:
+                os.unlink(chunk_file)
+
+        for fixture_spec, future in columnar_futures.items():
+            count, fixture_metrics = future.result()
+            metrics.merge(fixture_metrics)
+            _LOGGER.info(f"Totally {count} fixture rows are modified in {fixture_spec}!")
+
+def fixture_target(fixture_spec):
+    fixture_file, _, _ = parse_fixture_spec(fixture_spec)
+    return fixture_file
+
+def spec_target(spec):
+    # the target file of specs with optional column suffix, e.g. sql template spec
+    return spec.split(":")[0]
+
+def pending_specs(manifest, kind, specs, schema_diff, target_of):
+    """
+    Filter out specs whose target file was propagated with schema_diff according to
+    the manifest, all specs are pending without a manifest.
+    """
+    if manifest is None:
+        return list(specs)
+    pending = []
+    for spec in specs:
+        if manifest.is_applied(target_of(spec), manifest.applied_id(kind, spec, schema_diff)):
+            _LOGGER.info(f"Skip {kind} {spec}, the schema diff was already applied")
+            metrics.count("manifest_skips")
+        else:
+            pending.append(spec)
+    return pending
+
+def record_specs(manifest, kind, specs, schema_diff, target_of):
+    if manifest is None or target_writer.is_dry_run():
+        return
+    for spec in specs:
+        manifest.record(target_of(spec), manifest.applied_id(kind, spec, schema_diff))
+
+def apply_fixtures_incremental(fixture_specs, schema_diff, seed=0, jobs=1, manifest=None):
+    fixture_specs = pending_specs(manifest, "fixture", fixture_specs, schema_diff, fixture_target)
+    if not fixture_specs:
+        return
+    with metrics.stage("fixture"):
+        apply_fixtures(fixture_specs, compile_insertion_plan(schema_diff), seed, jobs)
+    record_specs(manifest, "fixture", fixture_specs, schema_diff, fixture_target)
+
+def apply_incremental(kind, spec, schema_diff, apply_func, manifest=None):
+    """
+    Apply schema_diff to a single spec by apply_func(spec, schema_diff), unless the
+    manifest says it was done.
+    """
+    if not pending_specs(manifest, kind, [spec], schema_diff, spec_target):
+        return
+    with metrics.stage(kind):
+        apply_func(spec, schema_diff)
+    record_specs(manifest, kind, [spec], schema_diff, spec_target)
+
+def modify_fixture(fixture_spec, schema_diff_file, seed, jobs=1, manifest=None):
+    apply_fixtures_incremental([fixture_spec], load_schema_diff(schema_diff_file), seed, jobs, manifest)
 
+def sql_ddl_columns(schema_diff, col_suffix):
+    """
+    Get the (column name, SQL type) pairs of new columns for prod tables.
+    """
+    columns = []
+    for key, conf in list_leaf(schema_diff):
+        col_name = f'{conf["target_name"]}{col_suffix}'
+        type_str = get_sql_type(conf).upper()
+        columns.append((col_name, type_str))
+    return columns
+
+def format_sql_ddl(table_name, columns, batched=False):
+    """
+    Format the SQL DDL statements which add columns to table_name.
+    >>> print(format_sql_ddl("hive_prod.lena.t", [("a", "LONG"), ("b", "ARRAY<STRING>")]))
+    ALTER TABLE hive_prod.lena.t ADD COLUMN a LONG;
+    ALTER TABLE hive_prod.lena.t ADD COLUMN b ARRAY<STRING>;
+    >>> print(format_sql_ddl("hive_prod.lena.t", [("a", "LONG"), ("b", "ARRAY<STRING>")], batched=True))
+    ALTER TABLE hive_prod.lena.t ADD COLUMNS (
+        a LONG,
+        b ARRAY<STRING>
+    );
+    """
+    if not batched:
+        return "\n".join(f"ALTER TABLE {table_name} ADD COLUMN {col_name} {type_str};" for col_name, type_str in columns)
+    if not columns:
+        return ""
+    column_defs = ",\n    ".join(f"{col_name} {type_str}" for col_name, type_str in columns)
+    return f"ALTER TABLE {table_name} ADD COLUMNS (\n    {column_defs}\n);"
+
+def apply_sql_ddl(table_spec, schema_diff, catalog, batched=False):
     tbl_specs = table_spec.split(":")
     table, col_suffix = tbl_specs[0], tbl_specs[1]
     table_name = f"{catalog}.{table}"
-    leaves = list_leaf(schema_diff)
-    for key, conf in leaves:
-        col_name = f'{conf["target_name"]}{col_suffix}'
-        type_str = get_sql_type(conf).upper()
-        print(f"ALTER TABLE {table_name} ADD COLUMN {col_name} {type_str};")
+    with metrics.stage("sql_ddl"):
+        columns = sql_ddl_columns(schema_diff, col_suffix)
+        if columns:
+            print(format_sql_ddl(table_name, columns, batched))
 
-def modify_sql_file(sql_spec, schema_diff_file):
-    _LOGGER.info(f"modify {sql_spec} with diff {schema_diff_file}")
-    with open(schema_diff_file) as f:
-        schema_diff = yaml.safe_load(f)
+def show_sql_ddl(table_spec, schema_diff_file, catalog, batched=False):
+    _LOGGER.info(f"Print SQL DDL, table_spec: {table_spec}, schema diff: {schema_diff_file}, catalog: {catalog}")
+    apply_sql_ddl(table_spec, load_schema_diff(schema_diff_file), catalog, batched)
 
+def merge_sql_ddl_columns(schema_diffs, schema_config):
+    """
+    Group new columns of many schemas by prod table, thus a table fed by more than
+    one schema is touched only once.
+    parameters:
+        schema_diffs:   A list of (schema file path, schema diff) tuples.
+        schema_config:  Dict which was load from schemas config file.
+    return:
+        Dict of prod table to the list of (column name, SQL type) pairs, in the order
+        of the given schemas. A column added twice with the same type is kept once,
+        ValueError is raised if a column name collides with a different type.
+    >>> config = {'schemas': [
+    ...     {'name': 'a', 'file': 'a.yaml', 'iceberg_table_schemas': [{'file': 'x', 'col_suffix': '_at_a', 'prod_tables': ['t']}]},
+    ...     {'name': 'b', 'file': 'b.yaml', 'iceberg_table_schemas': [{'file': 'x', 'col_suffix': '_at_b', 'prod_tables': ['t']}]}]}
+    >>> diff = {'type': 'struct', 'fields': [{'name': 'c', 'type': 'long', 'target_name': 'c'}]}
+    >>> merge_sql_ddl_columns([('a.yaml', diff), ('b.yaml', diff)], config)
+    {'t': [('c_at_a', 'LONG'), ('c_at_b', 'LONG')]}
+    """
+    tables = {}
+    sources = {}
+    for schema_path, schema_diff in schema_diffs:
+        config = show.get_schema_config(schema_config, schema_path)
+        if config is None:
+            _LOGGER.warning(f"No schema config found for {schema_path}, skip it!")
+            continue
+        for table_spec in show.parse_iceberg_tables_spec(config):
+            table, col_suffix = table_spec.split(":")[:2]
+            columns = tables.setdefault(table, [])
+            for col_name, type_str in sql_ddl_columns(schema_diff, col_suffix):
+                source = sources.get((table, col_name))
+                if source is None:
+                    sources[(table, col_name)] = (schema_path, type_str)
+                    columns.append((col_name, type_str))
+                elif source[1] != type_str:
+                    raise ValueError(f"Column {col_name} of {table} collides: {type_str} from {schema_path}"
+                                     f" VS {source[1]} from {source[0]}")
+                else:
+                    _LOGGER.warning(f"Column {col_name} of {table} is added by both {source[0]} and {schema_path}, keep one")
+    return {table: columns for table, columns in tables.items() if columns}
+
+def show_merged_sql_ddl(schema_diff_specs, schema_config_path, catalog, batched=False):
+    schema_config = show.load_schema_config(schema_config_path)
+    schema_diffs = []
+    for schema_diff_spec in schema_diff_specs:
+        schema_path, schema_diff_file = schema_diff_spec.split(":", 1)
+        if not os.path.exists(schema_diff_file):
+            # schema_subtract.py doesn't write the diff file if there are no changes
+            _LOGGER.info(f"No schema diff file {schema_diff_file} for {schema_path}, skip it!")
+            continue
+        schema_diffs.append((schema_path, load_schema_diff(schema_diff_file)))
+
+    with metrics.stage("sql_ddl"):
+        for table, columns in merge_sql_ddl_columns(schema_diffs, schema_config).items():
+            print(format_sql_ddl(f"{catalog}.{table}", columns, batched))
+
+def apply_sql_file(sql_spec, schema_diff):
     sql_specs = sql_spec.split(":")
     sql_file, col_suffix = sql_specs[0], sql_specs[1]
-    with open(sql_file) as f:
-        sql_str = f.read()
-    prefix, columns, suffix = extract_columns_from_sqlddl(sql_str)
-    old_col_def = [s.split(maxsplit=1) for s in columns]
+    sql_str = target_writer.read_text(sql_file)
     leaves = list_leaf(schema_diff)
+    existing_columns = set()
+    if leaves:
+        _, _, spans = tokenize_sqlddl_columns(sql_str)
+        existing_columns = {sql_column_name(sql_str[start:end]) for start, end in spans}
 
-    new_col_def = []
+    new_columns = []
     for key, conf in leaves:
         name = conf["target_name"]
         col_name = f"{name}{col_suffix}"
-        new_col_def.append([col_name, get_sql_type(conf)])
+        if col_name not in existing_columns:
+            new_columns.append(f"{col_name} {get_sql_type(conf)}")
 
-    txn_idxs = [i for i, col in enumerate(old_col_def) if col[0] == "txn_time"]
-    if len(txn_idxs) > 0:
-        idx = txn_idxs[0]
-        col_def = old_col_def[:idx] + new_col_def + old_col_def[idx:]
-    else:
-        col_def = old_col_def + new_col_def
+    # new columns are inserted before "txn_time" if it exists
+    target_writer.write_text(sql_file, splice_sqlddl_columns(sql_str, new_columns))
 
-    new_columns = [" ".join(d) for d in col_def]
-    with open(sql_file, "w") as f:
-        f.write(prefix)
-        f.write("\n    ")
-        f.write(",\n    ".join(new_columns))
-        f.write("\n")
-        f.write(suffix)
-
-def add_column_from_diff_file(column_file_spec, schema_diff_file):
-    with open(schema_diff_file) as f:
-        schema_diff = yaml.safe_load(f)
+def modify_sql_file(sql_spec, schema_diff_file, manifest=None):
+    _LOGGER.info(f"modify {sql_spec} with diff {schema_diff_file}")
+    apply_incremental("sql_template", sql_spec, load_schema_diff(schema_diff_file), apply_sql_file, manifest)
 
-    with open(column_file_spec) as f:
-        columns = json.load(f)
+def apply_column_spec(column_file_spec, schema_diff):
+    columns = json.loads(target_writer.read_text(column_file_spec))
 
     leaves = list_leaf(schema_diff)
-    new_columns = [conf["target_name"] for key, conf in leaves]
+    existing_columns = set(columns)
+    new_columns = [conf["target_name"] for key, conf in leaves if conf["target_name"] not in existing_columns]
     # Insert new columns before "txn_time" if it exists
     if "txn_time" in columns:
         idx = columns.index("txn_time")
@@ -347,16 +844,13 @@ def add_column_from_diff_file(column_file_spec, schema_diff_file):
     else:
         columns.extend(new_columns)
 
-    with open(column_file_spec, 'w') as f:
-        json.dump(columns, f, indent=2)
-        f.write("\n")
+    target_writer.write_text(column_file_spec, f"{json.dumps(columns, indent=2)}\n")
 
-def add_column_mapping_from_diff_file(column_trans_file, schema_diff_file):
-    with open(schema_diff_file) as f:
-        schema_diff = yaml.safe_load(f)
+def add_column_from_diff_file(column_file_spec, schema_diff_file, manifest=None):
+    apply_incremental("column_spec", column_file_spec, load_schema_diff(schema_diff_file), apply_column_spec, manifest)
 
-    with open(column_trans_file) as f:
-        column_mapping = json.load(f)
+def apply_column_mapping(column_trans_file, schema_diff):
+    column_mapping = json.loads(target_writer.read_text(column_trans_file))
 
     leaves = list_leaf(schema_diff)
     for key, conf in leaves:
@@ -364,9 +858,41 @@ def add_column_mapping_from_diff_file(column_trans_file, schema_diff_file):
         target_col_name = conf['target_name']
         column_mapping[col_left_exp] = target_col_name
 
-    with open(column_trans_file, 'w') as f:
-        json.dump(column_mapping, f, indent=2)
-        f.write("\n")
+    target_writer.write_text(column_trans_file, f"{json.dumps(column_mapping, indent=2)}\n")
+
+def add_column_mapping_from_diff_file(column_trans_file, schema_diff_file, manifest=None):
+    apply_incremental("column_tran", column_trans_file, load_schema_diff(schema_diff_file), apply_column_mapping, manifest)
+
+def apply_plan(schema_path, schema_diff_file, schema_config_path, catalog, seed, jobs=1, manifest=None, batched=False):
+    """
+    Propagate the schema diff to every target configured for schema_path in the
+    schema config file, in a single process. The schema diff and the schema config
+    are loaded only once, targets are resolved by the show.py parse functions and
+    applied in the same order as the add-field workflow does, the prod table DDLs
+    are printed to stdout at last.
+    """
+    _LOGGER.info(f"Apply plan for {schema_path} with diff {schema_diff_file}, schema config: {schema_config_path}")
+    schema_config = show.load_schema_config(schema_config_path)
+    config = show.get_schema_config(schema_config, schema_path)
+    if config is None:
+        _LOGGER.warning(f"No schema config found for {schema_path}, nothing to propagate!")
+        return
+
+    schema_diff = load_schema_diff(schema_diff_file)
+
+    for col_file_spec in show.parse_schema_column_files(config):
+        _LOGGER.info(f"plan: propagate column spec {col_file_spec}")
+        apply_incremental("column_spec", col_file_spec, schema_diff, apply_column_spec, manifest)
+    for col_trans_file in show.parse_schema_column_mapping_files(config):
+        _LOGGER.info(f"plan: propagate column transform {col_trans_file}")
+        apply_incremental("column_tran", col_trans_file, schema_diff, apply_column_mapping, manifest)
+    apply_fixtures_incremental(show.parse_schema_fixtures(config), schema_diff, seed, jobs, manifest)
+    for sql_spec in show.parse_schema_sql_templates(config):
+        _LOGGER.info(f"plan: propagate sql template {sql_spec}")
+        apply_incremental("sql_template", sql_spec, schema_diff, apply_sql_file, manifest)
+    for table_spec in show.parse_iceberg_tables_spec(config):
+        _LOGGER.info(f"plan: print sql ddl for {table_spec}")
+        apply_sql_ddl(table_spec, schema_diff, catalog, batched)
 
 
 def main(args):
@@ -374,21 +900,36 @@ def main(args):
         format='%(asctime)s %(name)s[%(levelname)s]: %(message)s',
         level=logging.INFO
     )
-    if args["fixture"]:
-        modify_fixture(args["<ci_fixture_file>"], args["--diff"], int(args["--seed"]))
-        return 0
-    if args["sql_template"]:
-        modify_sql_file(args["<sql_file>"], args["--diff"])
-        return 0
+    metrics.reset()
+    target_writer.set_dry_run(args["--dry-run"])
+    exit_code = run_command(args)
+    metrics.report(args["--timings"], args["--metrics-out"])
+    return exit_code
+
+def run_command(args):
     if args["sql_ddl"]:
-        show_sql_ddl(args["<table_spec>"], args["--diff"], args["--catalog"])
+        show_sql_ddl(args["<table_spec>"], args["--diff"], args["--catalog"], args["--batched"])
         return 0
-    if args["column_spec"]:
-        add_column_from_diff_file(args["<col_file_spec>"], args["--diff"])
+    if args["deploy_ddl"]:
+        show_merged_sql_ddl(args["<schema_diff_spec>"], args["--schema-config"], args["--catalog"], args["--batched"])
         return 0
+
+    manifest = PropagateManifest(args["--manifest"], args["--force"])
+    if args["fixture"]:
+        modify_fixture(args["<ci_fixture_file>"], args["--diff"], int(args["--seed"]), int(args["--jobs"]), manifest)
+    if args["sql_template"]:
+        modify_sql_file(args["<sql_file>"], args["--diff"], manifest)
+    if args["column_spec"]:
+        add_column_from_diff_file(args["<col_file_spec>"], args["--diff"], manifest)
     if args["column_tran"]:
-        add_column_mapping_from_diff_file(args["<col_trans_file>"], args["--diff"])
-        return 0
+        add_column_mapping_from_diff_file(args["<col_trans_file>"], args["--diff"], manifest)
+    if args["plan"]:
+        apply_plan(args["<schema_file>"], args["--diff"], args["--schema-config"],
+                   args["--catalog"], int(args["--seed"]), int(args["--jobs"]), manifest, args["--batched"])
+    if target_writer.is_dry_run():
+        target_writer.report_dry_run()
+    else:
+        manifest.save()
     return 0
 
 
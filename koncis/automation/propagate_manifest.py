@@ -0,0 +1,105 @@
+'''
+Sidecar manifest of propagate.py, which records for every target file the schema
+diffs already applied and the content hash of the file after writing.
+
+A target is skipped when its content hash still matches the manifest and the same
+schema diff was applied to it with the same spec, so re-running propagation on the
+same PR doesn't parse and rewrite untouched files. Target paths are normalized, so
+every spelling of a path shares one entry.
+
+The manifest is a file of the working tree, thus only reruns in the same checkout
+benefit from it, e.g. local reruns. A fresh CI checkout starts with an empty manifest
+unless the file is restored, e.g. by actions/cache.
+'''
+import os
+import json
+import hashlib
+import logging
+
+import target_writer
+
+_LOGGER     = logging.getLogger('propagate_manifest.py')
+
+# bump it when the manifest layout changes
+_MANIFEST_VERSION   = 1
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def diff_fingerprint(schema_diff):
+    encoded = json.dumps(schema_diff, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class PropagateManifest:
+    """
+    The manifest is keyed by target file path, each entry looks like:
+        {"hash": <content sha256 after writing>, "applied": [<applied id>, ...]}
+    An applied id identifies the target kind, the target spec and the schema diff.
+    """
+
+    def __init__(self, path, force=False):
+        self.path = path
+        self.force = force
+        self.targets = {}
+        # content hash of targets when they are checked, before applying
+        self._checked_hashes = {}
+        # the last fingerprinted schema diff and its fingerprint
+        self._fingerprint = (None, None)
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return
+        if manifest.get("version") == _MANIFEST_VERSION:
+            self.targets = {target_writer.target_key(k): v for k, v in manifest["targets"].items()}
+
+    def applied_id(self, kind, spec, schema_diff):
+        """
+        >>> manifest = PropagateManifest("missing/manifest.json")
+        >>> manifest.applied_id("fixture", "./a.txt::", {}) == manifest.applied_id("fixture", "a.txt::", {})
+        True
+        """
+        # specs start with the target path, the rest is e.g. the column suffix
+        target_file, sep, rest = spec.partition(":")
+        spec = f"{target_writer.target_key(target_file)}{sep}{rest}"
+        fingerprinted_diff, fingerprint = self._fingerprint
+        if fingerprinted_diff is not schema_diff:
+            fingerprint = diff_fingerprint(schema_diff)
+            self._fingerprint = (schema_diff, fingerprint)
+        return hashlib.sha256(f"{kind}:{spec}:{fingerprint}".encode()).hexdigest()
+
+    def is_applied(self, target_file, applied_id):
+        """
+        Check whether applied_id was applied to the current content of target_file,
+        always False when force is set.
+        """
+        target_file = target_writer.target_key(target_file)
+        content_hash = file_hash(target_file)
+        self._checked_hashes[target_file] = content_hash
+        if self.force:
+            return False
+        entry = self.targets.get(target_file)
+        return entry is not None and entry["hash"] == content_hash and applied_id in entry["applied"]
+
+    def record(self, target_file, applied_id):
+        target_file = target_writer.target_key(target_file)
+        entry = self.targets.get(target_file)
+        applied = []
+        # keep applied ids only if the file was not changed by others since recorded
+        if entry is not None and entry["hash"] == self._checked_hashes.get(target_file):
+            applied = [i for i in entry["applied"] if i != applied_id]
+        applied.append(applied_id)
+        self.targets[target_file] = {"hash": file_hash(target_file), "applied": applied}
+
+    def save(self):
+        dir_name = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(dir_name, exist_ok=True)
+        content = json.dumps({"version": _MANIFEST_VERSION, "targets": self.targets}, indent=2, sort_keys=True)
+        target_writer.write_file(self.path, f"{content}\n")
+        _LOGGER.info(f"Saved propagate manifest {self.path}")
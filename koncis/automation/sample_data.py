@@ -0,0 +1,133 @@
+'''
+Sample value engine of fixture propagation.
+
+Every new leaf gets a sample pool compiled once per schema diff: the configured
+sample_data, or default values which fit its spark type. Values are drawn for a
+batch of lines at once by a single random.choices call per leaf, optionally
+weighted by sample_weights, and null is drawn as one more pool value with the
+probability of null_rate for nullable leaves.
+
+Schema diff field keys used by the engine:
+    sample_data:    list of sample values, default values of the type if missing.
+    sample_weights: list of relative weights of sample_data, in the same order.
+    null_rate:      probability of null in [0, 1), only applied if nullable is true.
+'''
+import os
+import json
+import random
+import itertools
+from collections import namedtuple
+
+# number of lines whose samples are drawn at once
+SAMPLE_BATCH_LINES  = 1000
+
+# default sample data of spark POD types, the values are in the JSON layout of spark,
+# i.e. binary in base64, date and timestamp in ISO 8601
+DEFAULT_SAMPLE_DATA = {
+    "boolean":      [True, False],
+    "byte":         [0, 1, -1, 127, -128],
+    "short":        [0, 1, -1, 32767, -32768],
+    "integer":      [0, 1, -1, 2147483647, -2147483648],
+    "long":         [0, 1, -1, 9223372036854775807, -9223372036854775808],
+    "float":        [0.0, 1.5, -1.5, 3.25],
+    "double":       [0.0, 0.3, -0.7, 1234.5678],
+    "string":       ["", "sample", "sample data"],
+    "binary":       ["", "AA==", "c2FtcGxl"],
+    "date":         ["1970-01-01", "2024-02-29"],
+    "timestamp":    ["1970-01-01T00:00:00.000Z", "2024-02-29T12:34:56.789Z"],
+}
+
+# A compiled sample pool of a leaf.
+#   values:         tuple of sample values, the last one is None if null may be drawn.
+#   encoded:        tuple of json encoded values in the same order.
+#   cum_weights:    tuple of cumulative weights for random.choices, None for uniform draws.
+SamplePool = namedtuple("SamplePool", ["values", "encoded", "cum_weights"])
+
+
+def default_sample_data(spark_type):
+    """
+    Get default sample data which fits a spark type, arrays get an empty list, a
+    list of one and a list of two default values of the element type.
+    >>> default_sample_data('boolean')
+    [True, False]
+    >>> default_sample_data({'type': 'array', 'elementType': 'byte'})
+    [[], [0], [0, 1]]
+    """
+    if isinstance(spark_type, dict):
+        if 'elementType' not in spark_type:
+            raise ValueError(f"No default sample data for type {spark_type}, please set sample_data")
+        elements = default_sample_data(spark_type['elementType'])
+        return [[], elements[:1], elements[:2]]
+    if spark_type not in DEFAULT_SAMPLE_DATA:
+        raise ValueError(f"No default sample data for type {spark_type}, please set sample_data")
+    return list(DEFAULT_SAMPLE_DATA[spark_type])
+
+def compile_sample_pool(conf):
+    """
+    Compile the sample pool of a schema diff leaf.
+    >>> pool = compile_sample_pool({'name': 'a', 'type': 'long', 'nullable': True,
+    ...                             'sample_data': [1, 2], 'sample_weights': [3, 1], 'null_rate': 0.2})
+    >>> pool.values, pool.encoded, pool.cum_weights
+    ((1, 2, None), ('1', '2', 'null'), (0.6000000000000001, 0.8, 1.0))
+    """
+    samples = conf.get("sample_data")
+    if samples is None:
+        samples = default_sample_data(conf["type"])
+    if len(samples) == 0:
+        raise ValueError(f"sample_data of {conf['name']} is empty")
+    weights = conf.get("sample_weights")
+    if weights is not None and (len(weights) != len(samples) or min(weights) < 0 or sum(weights) <= 0):
+        raise ValueError(f"sample_weights of {conf['name']} should be non-negative weights of every sample_data")
+    null_rate = conf.get("null_rate", 0) if conf.get("nullable") is True else 0
+    if not 0 <= null_rate < 1:
+        raise ValueError(f"null_rate of {conf['name']} should be in [0, 1), but got {null_rate}")
+
+    values = tuple(samples)
+    cum_weights = None
+    if weights is not None or null_rate > 0:
+        weights = weights or [1] * len(values)
+        total = sum(weights)
+        weights = [w / total * (1 - null_rate) for w in weights]
+        if null_rate > 0:
+            values += (None,)
+            weights.append(null_rate)
+        cum_weights = tuple(itertools.accumulate(weights))
+    return SamplePool(values, tuple(json.dumps(v) for v in values), cum_weights)
+
+def draw_indexes(pool, count, rng):
+    """
+    Draw count indexes of pool values in one call.
+    """
+    return rng.choices(range(len(pool.values)), cum_weights=pool.cum_weights, k=count)
+
+def draw_rows(pools, count, rng):
+    """
+    Draw the pool indexes of count lines at once, the pools are drawn one by one.
+    return:
+        A list of tuples, each is the indexes of a line in the order of pools.
+    >>> import random
+    >>> pools = [compile_sample_pool({'name': 'a', 'type': 'boolean'})]
+    >>> len(draw_rows(pools, 3, random.Random(1))), draw_rows([], 2, random)
+    (3, [(), ()])
+    """
+    if not pools:
+        return [()] * count
+    return list(zip(*[draw_indexes(pool, count, rng) for pool in pools]))
+
+def fixture_random(seed, fixture_file, line_no=None):
+    """
+    Get the random generator of a fixture file, or of a batch of its lines starting
+    from line_no, which only depends on the seed and the fixture identity. The path is
+    normalized relative to the working directory, thus every spelling of the same file
+    gets the same generator. Return the global random state if seed is not applied.
+    >>> fixture_random(7, 'a.txt', 3).random() == fixture_random(7, './x/../a.txt', 3).random()
+    True
+    >>> fixture_random(0, 'a.txt') is random
+    True
+    """
+    if seed <= 0:
+        return random
+    key = f"{seed}:{os.path.relpath(fixture_file)}"
+    if line_no is not None:
+        key = f"{key}:{line_no}"
+    return random.Random(key)
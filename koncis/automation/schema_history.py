@@ -0,0 +1,351 @@
+#! /usr/bin/env python
+'''
+This application will keep the versions of schema files in a local history store, and
+print the fields added between any two versions as a schema diff.
+
+Usage:
+    schema_history.py (-h | --help)
+    schema_history.py add [--timings] [--metrics-out=<metrics_file>] [--store=<store_dir>] [--label=<label>] <schema_name> <schema_file>
+    schema_history.py import [--timings] [--metrics-out=<metrics_file>] [--store=<store_dir>] --git-range=<git_range> <schema_name> <schema_file>
+    schema_history.py versions [--store=<store_dir>] <schema_name>
+    schema_history.py diff [--timings] [--metrics-out=<metrics_file>] [--store=<store_dir>] [--diff-format=<format>] <schema_name> <from_version> <to_version> <output_file>
+
+Options:
+    -h, --help                  Print this screen and exit.
+    --store=<store_dir>         Specify the directory of the history store, one JSON file per
+                                schema name.
+                                [default: .auto/schema-history]
+    --label=<label>             Specify a unique label of the new version, e.g. a release name, which
+                                can be used in place of the version number.
+    --git-range=<git_range>     Add a version for every commit in the revision range which changed
+                                schema_file, oldest first, labeled by the commit hash. The base of the
+                                range is added first if the store is empty. Commits which are in the
+                                store already are skipped.
+    --diff-format=<format>      Specify the format of schema diff, "yaml" or "json" in the spark
+                                JSON schema layout, propagate.py reads both.
+                                [default: yaml]
+    --timings                   Log the wall time of each stage and the counters at last.
+    --metrics-out=<metrics_file>    Write the wall time of each stage and the counters, e.g. the
+                                number of candidate fields of a diff, to file in JSON.
+    <schema_name>               The name of schema, e.g. the name in schema config file.
+    <schema_file>               The schema file path, YAML or spark JSON schema. In the import
+                                mode it is the path in git.
+    <from_version>              The base version number or label, 0 is the empty schema.
+    <to_version>                The new version number or label.
+    <output_file>               The file path which accept schema diff info, the same as the
+                                output of schema_subtract.py.
+
+Every field (struct fields and the fields under arrays of struct too) gets a stable id
+keyed by its parent id and name. The store records for each field the version spans it
+is present in, and the changes of its own data (the field without its children) and
+of its position among the siblings, and for each version the ids of fields which
+appeared in it. Thus the fields added between version A and B are found from the
+versions in (A, B] only, in time proportional to the number of changes, and the diff
+is rebuilt from them and their ancestors as of version B.
+'''
+from docopt import docopt
+import os
+import sys
+import json
+import bisect
+import logging
+
+import metrics
+import git_blobs
+import history_tree
+import yaml_loader
+import target_writer
+import schema_subtract
+
+_LOGGER     = logging.getLogger('schema_history.py')
+
+# bump it when the store layout changes
+_STORE_VERSION  = 1
+
+_KEY_FIELDS     = "fields"
+_KEY_ELEMENT    = "elementType"
+
+# a field record is a list of [parent id, name, spans, data changes, position changes],
+# spans are [first version, end version or None], changes are [version, value]
+_PARENT         = 0
+_NAME           = 1
+_SPANS          = 2
+_DATA           = 3
+_POSITIONS      = 4
+
+
+def new_store():
+    return {"version": _STORE_VERSION, "versions": [], "fields": []}
+
+def store_path(store_dir, schema_name):
+    return os.path.join(store_dir, f"{schema_name}.json")
+
+def load_store(store_dir, schema_name):
+    """
+    Load the history store of a schema, an empty store if it doesn't exist yet.
+    """
+    with metrics.stage("load_store"):
+        try:
+            with open(store_path(store_dir, schema_name), 'rb') as f:
+                store = json.load(f)
+        except FileNotFoundError:
+            return new_store()
+    if store.get("version") != _STORE_VERSION:
+        raise ValueError(f"Unsupported history store version {store.get('version')} of {schema_name}")
+    return store
+
+def save_store(store_dir, schema_name, store):
+    with metrics.stage("save_store"):
+        os.makedirs(store_dir, exist_ok=True)
+        target_writer.write_file(store_path(store_dir, schema_name), json.dumps(store, separators=(',', ':'), default=str))
+
+# field shells, i.e. a field or a type without the fields of its structs
+def shell_type(node):
+    if node.kind is history_tree.NodeKind.STRUCT:
+        return node.with_fields(())
+    if node.kind is history_tree.NodeKind.ARRAY:
+        return node.with_element(shell_type(node.element))
+    return node
+
+def struct_of(node):
+    """
+    Get the struct whose fields are the children of a field type, through arrays, None
+    for other types.
+    """
+    while node.kind is history_tree.NodeKind.ARRAY:
+        node = node.element
+    return node if node.kind is history_tree.NodeKind.STRUCT else None
+
+def type_signature(type_data):
+    """
+    Get the signature of a shell type which must not change while a field is present,
+    like schema_subtract requires.
+    >>> type_signature({'type': 'array', 'containsNull': True, 'elementType': {'type': 'struct', 'fields': []}})
+    ['array', 'struct']
+    """
+    node = history_tree.parse_type(type_data)
+    if node.kind is history_tree.NodeKind.STRUCT:
+        return "struct"
+    if node.kind is history_tree.NodeKind.ARRAY:
+        return ["array", type_signature(type_data[_KEY_ELEMENT])]
+    return type_data
+
+def fill_fields(type_data, fields):
+    """
+    Copy a shell type with the fields of its struct, which may be under arrays.
+    """
+    if isinstance(type_data, dict) and _KEY_ELEMENT in type_data:
+        return {k: fill_fields(v, fields) if k == _KEY_ELEMENT else v for k, v in type_data.items()}
+    return {k: fields if k == _KEY_FIELDS else v for k, v in type_data.items()}
+
+# version lookups
+def is_present(record, version):
+    return any(start <= version and (end is None or version < end) for start, end in record[_SPANS])
+
+def value_at(changes, version):
+    """
+    Get the value of [version, value] changes which is effective at version.
+    >>> value_at([[1, 'a'], [3, 'b']], 2), value_at([[1, 'a'], [3, 'b']], 3)
+    ('a', 'b')
+    """
+    i = bisect.bisect_right(changes, version, key=lambda change: change[0])
+    return changes[i - 1][1]
+
+def resolve_version(store, version):
+    """
+    Get the version number of a version number or label.
+    """
+    if isinstance(version, int) or version.isdigit():
+        number = int(version)
+        if number > len(store["versions"]):
+            raise ValueError(f"Unknown version {version}, the latest one is {len(store['versions'])}")
+        return number
+    for number, v in enumerate(store["versions"], start=1):
+        if v["label"] == version:
+            return number
+    raise ValueError(f"Unknown version label {version}")
+
+def add_version(store, schema, label=None):
+    """
+    Add a schema dict as the next version of the store.
+    return:
+        The new version number.
+    """
+    if label is not None and any(v["label"] == label for v in store["versions"]):
+        raise ValueError(f"Version label {label} exists already")
+    version = len(store["versions"]) + 1
+    records = store["fields"]
+    index = {(r[_PARENT], r[_NAME]): i for i, r in enumerate(records)}
+    present = set()
+    added = []
+
+    def add_fields(struct, parent):
+        for position, f in enumerate(struct.fields):
+            key = (parent, f.name)
+            field_id = index.get(key)
+            if field_id is None:
+                field_id = index[key] = len(records)
+                records.append([parent, f.name, [], [], []])
+            elif field_id in present:
+                _LOGGER.warning(f"Ignore duplicated field {f.name} of version {version}")
+                continue
+            record = records[field_id]
+            present.add(field_id)
+            data = f.with_type(shell_type(f.type)).to_yaml()
+            spans, changes, positions = record[_SPANS], record[_DATA], record[_POSITIONS]
+            was_present = bool(spans) and spans[-1][1] is None
+            if not was_present:
+                spans.append([version, None])
+                added.append(field_id)
+            if not changes or changes[-1][1] != data:
+                if was_present and type_signature(changes[-1][1]["type"]) != type_signature(data["type"]):
+                    raise ValueError(f"The type of field {f.name} is changed in version {version}, "
+                                     f"{changes[-1][1]['type']} VS {data['type']}")
+                changes.append([version, data])
+            if not positions or positions[-1][1] != position:
+                positions.append([version, position])
+            child = struct_of(f.type)
+            if child is not None:
+                add_fields(child, field_id)
+
+    with metrics.stage("add_version"):
+        tree = history_tree.parse_schema(schema)
+        add_fields(tree, None)
+        for field_id, record in enumerate(records):
+            spans = record[_SPANS]
+            if field_id not in present and spans and spans[-1][1] is None:
+                spans[-1][1] = version
+        store["versions"].append({"label": label, "root": tree.with_fields(()).to_yaml(), "added": added})
+    _LOGGER.info(f"Version {version} has {len(present)} fields, {len(added)} of them are added")
+    return version
+
+def diff_versions(store, from_version, to_version):
+    """
+    Get the fields added from from_version to to_version, in the same layout as
+    schema_subtract does for the schemas of the 2 versions.
+    return:
+        The schema diff dict, None if there are no changes.
+    >>> store = new_store()
+    >>> add_version(store, {'type': 'struct', 'fields': [{'name': 'a', 'type': 'long'}]})
+    1
+    >>> add_version(store, {'type': 'struct', 'fields': [
+    ...     {'name': 'b', 'type': {'type': 'array', 'elementType': {'type': 'struct', 'fields': [
+    ...         {'name': 'c', 'type': 'string'}]}}},
+    ...     {'name': 'a', 'type': 'long'}]}, 'v2')
+    2
+    >>> diff_versions(store, 0, 1)
+    {'type': 'struct', 'fields': [{'name': 'a', 'type': 'long'}]}
+    >>> diff_versions(store, 1, resolve_version(store, 'v2'))['fields'][0]['type']['elementType']
+    {'type': 'struct', 'fields': [{'name': 'c', 'type': 'string'}]}
+    >>> diff_versions(store, 2, 2) is None
+    True
+    """
+    if from_version > to_version:
+        raise ValueError(f"The from version {from_version} should not be after the to version {to_version}")
+    records = store["fields"]
+    with metrics.stage("diff_versions"):
+        candidates = dict.fromkeys(field_id for v in store["versions"][from_version:to_version] for field_id in v["added"])
+        metrics.count("history_candidates", len(candidates))
+        added = [i for i in candidates if is_present(records[i], to_version) and not is_present(records[i], from_version)]
+        if not added:
+            return None
+
+        # the added fields and their ancestors, keyed by parent id
+        children = {}
+        seen = set()
+        for field_id in added:
+            while field_id is not None and field_id not in seen:
+                seen.add(field_id)
+                parent = records[field_id][_PARENT]
+                children.setdefault(parent, []).append(field_id)
+                field_id = parent
+
+        def build_fields(parent):
+            fields = []
+            for field_id in sorted(children[parent], key=lambda i: value_at(records[i][_POSITIONS], to_version)):
+                data = value_at(records[field_id][_DATA], to_version)
+                if field_id in children:
+                    data = {k: fill_fields(v, build_fields(field_id)) if k == "type" else v for k, v in data.items()}
+                fields.append(data)
+            return fields
+
+        return fill_fields(store["versions"][to_version - 1]["root"], build_fields(None))
+
+
+def add_schema_file(store_dir, schema_name, schema_file, label):
+    store = load_store(store_dir, schema_name)
+    with metrics.stage("parse"):
+        schema = yaml_loader.load_yaml(schema_file)
+    version = add_version(store, schema, label)
+    save_store(store_dir, schema_name, store)
+    print(version)
+
+def import_git_range(store_dir, schema_name, schema_file, git_range):
+    """
+    Add a version for every commit in git_range which changed schema_file, the base
+    of the range goes first if the store is empty. Commits which are in the store
+    already are skipped.
+    """
+    store = load_store(store_dir, schema_name)
+    labels = {v["label"] for v in store["versions"]}
+    with metrics.stage("git"):
+        base, head = git_blobs.resolve_range(git_range)
+        revisions = git_blobs.file_revisions(base, head, schema_file)
+        if not store["versions"]:
+            revisions.insert(0, git_blobs.run_git("rev-parse", base).strip())
+        revisions = [r for r in revisions if r not in labels]
+    _LOGGER.info(f"There are {len(revisions)} new versions of {schema_file} in {git_range}")
+    with git_blobs.BlobReader() as reader:
+        for revision in revisions:
+            with metrics.stage("git"):
+                content = reader.read(revision, schema_file)
+            if content is None:
+                _LOGGER.info(f"Skip {revision}, {schema_file} is deleted in it")
+                continue
+            with metrics.stage("parse"):
+                schema = yaml_loader.parse_document(content, schema_file)
+            add_version(store, schema, revision)
+    save_store(store_dir, schema_name, store)
+
+def print_versions(store_dir, schema_name):
+    store = load_store(store_dir, schema_name)
+    for number, v in enumerate(store["versions"], start=1):
+        print(f"{number} {v['label'] or '-'} {len(v['added'])}")
+
+def write_diff(store_dir, schema_name, from_version, to_version, output_file, diff_format):
+    store = load_store(store_dir, schema_name)
+    from_version = resolve_version(store, from_version)
+    to_version = resolve_version(store, to_version)
+    schema_diff = diff_versions(store, from_version, to_version)
+    if schema_diff is None:
+        _LOGGER.info(f"No fields are added from version {from_version} to {to_version}")
+        return
+    _LOGGER.info(f"Saving added schemas to file {output_file}")
+    with open(output_file, "w") as of:
+        of.write(schema_subtract.dump_schema_diff(schema_diff, diff_format))
+
+
+def main(args):
+    metrics.reset()
+    store_dir = args["--store"]
+    if args["add"]:
+        add_schema_file(store_dir, args["<schema_name>"], args["<schema_file>"], args["--label"])
+    elif args["import"]:
+        import_git_range(store_dir, args["<schema_name>"], args["<schema_file>"], args["--git-range"])
+    elif args["versions"]:
+        print_versions(store_dir, args["<schema_name>"])
+    elif args["diff"]:
+        if args["--diff-format"] not in schema_subtract.DIFF_FORMATS:
+            _LOGGER.error(f'Unsupported diff format {args["--diff-format"]}, it should be one of {schema_subtract.DIFF_FORMATS}')
+            return 1
+        write_diff(store_dir, args["<schema_name>"], args["<from_version>"], args["<to_version>"],
+                   args["<output_file>"], args["--diff-format"])
+    metrics.report(args["--timings"], args["--metrics-out"])
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format='%(asctime)s %(name)s[%(levelname)s]: %(message)s',
+        level=logging.INFO
+    )
+    sys.exit(main(docopt(__doc__)))
@@ -1,21 +1,70 @@
 #! /usr/bin/env python
 '''
-This application will extract schema changes from 2 version of schema file
+This application will extract schema changes from 2 version of schema file, schema files
+are YAML or spark JSON schemas (df.schema.json()), JSON is detected by the .json extension
+or the content.
 
 Usage:
     schema_subtract.py (-h | --help)
-    schema_subtract.py <new_version_file> <old_version_file> <output_file>
+    schema_subtract.py [--cache-dir=<cache_dir>] [--cache-size=<MB>] [--no-cache] [--diff-format=<format>] [--timings] [--metrics-out=<metrics_file>] <new_version_file> <old_version_file> <output_file>
+    schema_subtract.py [--cache-dir=<cache_dir>] [--cache-size=<MB>] [--no-cache] [--diff-format=<format>] [--timings] [--metrics-out=<metrics_file>] [--jobs=<N>] [--summary=<summary_file>] --git-range=<git_range> [--path=<path>] [--output-dir=<output_dir>]
+    schema_subtract.py [--cache-dir=<cache_dir>] [--cache-size=<MB>] [--no-cache] [--diff-format=<format>] [--timings] [--metrics-out=<metrics_file>] [--jobs=<N>] [--summary=<summary_file>] --pairs=<pairs_file>
+    schema_subtract.py [--cache-dir=<cache_dir>] [--cache-size=<MB>] [--no-cache] [--diff-format=<format>] [--timings] [--metrics-out=<metrics_file>] [--jobs=<N>] [--summary=<summary_file>] --new-dir=<new_dir> --old-dir=<old_dir> [--output-dir=<output_dir>]
 
 Options:
-    -h, --help          Print this screen and exit.
-    <new_version_file>  New schema version file, contains new added fields.
-    <old_version_file>  Base schema file.
-    <output_file>       The file path which accept schema diff info.
+    -h, --help                  Print this screen and exit.
+    --cache-dir=<cache_dir>     Specify the directory of schema diff cache, which is keyed by the
+                                content of both schema files and the version of this tool.
+                                [default: .auto/cache/schema_subtract]
+    --cache-size=<MB>           Specify the max size of schema diff cache in MB, least recently
+                                used entries are evicted beyond it.
+                                [default: 64]
+    --no-cache                  Always compute the schema diff, don't read or write the cache.
+    --diff-format=<format>      Specify the format of schema diff, "yaml" or "json" in the spark
+                                JSON schema layout, propagate.py reads both.
+                                [default: yaml]
+    --timings                   Log the wall time of each stage and the counters at last.
+    --metrics-out=<metrics_file>    Write the wall time of each stage and the counters, e.g. read
+                                bytes, compared fields and cache hits, to file in JSON.
+    --git-range=<git_range>     Subtract every schema file changed in the revision range, e.g.
+                                origin/master...HEAD, both versions are read from git objects and
+                                the working tree is never modified. The schema files whose diff is
+                                written are printed, one per line. New files missing in the base and
+                                files without new fields are skipped.
+    --path=<path>               Specify the directory of schema files in the git range mode.
+                                [default: automation/schemas]
+    --pairs=<pairs_file>        Subtract many schema pairs, each line of the file is
+                                "<new_version_file> <old_version_file> <output_file>".
+    --new-dir=<new_dir>         Subtract every schema file of new_dir with the file of the same name
+                                in old_dir.
+    --old-dir=<old_dir>         Specify the directory of base schema files in the directory mode.
+    --output-dir=<output_dir>   Specify the directory which accepts the schema diff of each changed
+                                schema file in the git range and directory modes, named by its
+                                base name.
+                                [default: .auto]
+    --jobs=<N>                  Specify the number of worker processes which subtract schema pairs
+                                concurrently in the git range, pairs and directory modes.
+                                [default: 1]
+    --summary=<summary_file>    Write the summary of subtracted schemas in JSON, a list of
+                                {"schema", "output", "changed"} objects in the input order.
+    <new_version_file>          New schema version file, contains new added fields.
+    <old_version_file>          Base schema file.
+    <output_file>               The file path which accept schema diff info.
 '''
 from docopt import docopt
+import os
 import sys
+import json
+import hashlib
 import logging
 
+import metrics
+import git_blobs
+import disk_cache
+import schema_tree
+import yaml_loader
+import target_writer
+
 import yaml
 try:
     from yaml import CLoader as Loader, CDumper as Dumper
@@ -24,23 +73,16 @@ except ImportError:
 
 _LOGGER     = logging.getLogger('schema_subtract.py')
 
-def is_empty_schema(scm):
-    if scm == None:
-        return True
-
-    if scm['type'] == 'struct':
-        return len(scm['fields']) == 0
+# suffix of cache entries, the "no changes" marker has no content
+_CACHE_DIFF_SUFFIX  = ".diff.yaml"
+_CACHE_EMPTY_SUFFIX = ".empty"
 
-def find_name(fields, name):
-    for i,v in enumerate(fields):
-        if v['name'] == name:
-            _LOGGER.debug(f"Find {name} in index {i}")
-            return i
-    _LOGGER.debug(f"Didn't find {name}, return -1" )
-    return -1
+DIFF_FORMATS        = ("yaml", "json")
 
 def schema_subtract(new_scm, old_scm):
     """
+    Subtract 2 versions of schema loaded from YAML, the inputs are left untouched and
+    a new diff dict is returned, None if there are no changes.
     >>> import yaml
     >>> new_scm_txt = '''
     ... fields:
@@ -147,6 +189,8 @@ def schema_subtract(new_scm, old_scm):
     ... '''
     >>> old_scm = yaml.safe_load(old_scm_txt)
     >>> scm_diff = schema_subtract(new_scm, old_scm)
+    >>> new_scm == yaml.safe_load(new_scm_txt)
+    True
     >>> print(yaml.dump(scm_diff))
     fields:
     - metadata: {}
@@ -192,72 +236,286 @@ def schema_subtract(new_scm, old_scm):
     type: struct
     <BLANKLINE>
     """
-    if isinstance(new_scm, str):
-        assert new_scm == old_scm, f"string type must be matched"
-        _LOGGER.debug(f"schema_subtract: applied subtract on matched type {new_scm}")
-        return None
-    if isinstance(new_scm['type'], dict):
-        # it should be array
-        if 'elementType' in new_scm['type']:
-            assert isinstance(old_scm['type'], dict), f"schema_subtract: the old schema should be array type"
-            assert 'elementType' in old_scm['type'], f'schema_subtract: old schema must have elementType in array type'
-            res = schema_subtract(new_scm['type']['elementType'], old_scm['type']['elementType'])
-            _LOGGER.debug(f"schema_subtract: applied on array type with name: {new_scm['name']}")
-            if res == None:
-                return None
-            else:
-                return new_scm
-        elif 'type' in new_scm['type']:
-            assert isinstance(old_scm['type'], dict), f"schema_subtract: the old schema should be struct type"
-            assert 'type' in old_scm['type'], 'schema_subtract: the old schema must have type in struct type'
-            res = schema_subtract_struct(new_scm['type'], old_scm['type'])
-            if res == None:
-                return None
-            else:
-                return new_scm
-    elif new_scm['type'] == 'struct':
-        return schema_subtract_struct(new_scm, old_scm)
-    else:
-        # for POD types
-        _LOGGER.debug("this should be touched")
-        assert new_scm['type'] == old_scm['type'], f"schema_subtract: pod types must be matched, but get {new_scm['type']} VS {old_scm['type']}"
+    return schema_tree.subtract(new_scm, old_scm)
+
+
+def dump_schema_diff(schema_diff, diff_format="yaml"):
+    """
+    Dump the schema diff in YAML, or in JSON like spark does.
+    >>> print(dump_schema_diff({'type': 'struct', 'fields': []}, 'json'), end='')
+    {"type":"struct","fields":[]}
+    """
+    if diff_format == "json":
+        return f"{json.dumps(schema_diff, separators=(',', ':'))}\n"
+    return yaml.dump(schema_diff, sort_keys=False)
+
+def subtract_schema_text(new_text, old_text, diff_format="yaml"):
+    """
+    Subtract 2 versions of schema in YAML or JSON text. The schemas are loaded through
+    the yaml_loader snapshots, thus the subtree hashes of a schema content which was
+    seen before let subtract skip the unchanged structs.
+    return:
+        The schema diff dumped in diff_format, None if there are no changes.
+    """
+    with metrics.stage("parse"):
+        new_config, new_hashes = yaml_loader.load_schema_content(new_text, loader=Loader)
+        old_config, old_hashes = yaml_loader.load_schema_content(old_text, loader=Loader)
+
+    with metrics.stage("subtract"):
+        remains = schema_tree.subtract(new_config, old_config, new_hashes, old_hashes)
+    _LOGGER.debug("The subtract results is %s", remains)
+    if remains is None:
         return None
+    with metrics.stage("dump"):
+        return dump_schema_diff(remains, diff_format)
+
+# functions for schema diff cache
+def tool_fingerprint():
+    """
+    The version fingerprint of this tool, cached diffs from other versions are not used.
+    The modules which parse and subtract schemas take part as well as this one.
+    """
+    digest = hashlib.sha256()
+    for module_file in (__file__, schema_tree.__file__, yaml_loader.__file__):
+        with open(module_file, 'rb') as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+def schema_diff_cache_key(new_text, old_text, diff_format="yaml"):
+    digest = hashlib.sha256(f"{tool_fingerprint()}:{diff_format}".encode())
+    for text in (new_text, old_text):
+        digest.update(hashlib.sha256(text).digest())
+    return digest.hexdigest()
 
-def schema_subtract_struct(new_scm, old_scm):
-    assert old_scm['type'] == 'struct', f"schema_subtract: old schema must be struct type, but it is {old_scm['type']}"
-    for i,v in enumerate(new_scm['fields']):
-        name = new_scm['fields'][i]['name']
-        _LOGGER.debug(f"Try check for {name}")
-        j = find_name(old_scm['fields'], name)
-        if j < 0:
-            # didn't find the name
+def load_cached_diff(cache_dir, key):
+    """
+    Load schema diff from cache.
+    return:
+        A tuple of (hit, diff text), diff text is None for the "no changes" marker.
+    """
+    for suffix in (_CACHE_DIFF_SUFFIX, _CACHE_EMPTY_SUFFIX):
+        path = os.path.join(cache_dir, f"{key}{suffix}")
+        try:
+            with open(path) as f:
+                diff_text = f.read()
+        except FileNotFoundError:
             continue
-        res = schema_subtract(new_scm['fields'][i], old_scm['fields'][j])
-        new_scm['fields'][i] = res
-    _LOGGER.debug(f"fields: {new_scm['fields']}")
-    new_scm['fields'] = [i for i in new_scm['fields'] if i]
-    _LOGGER.debug(f"schema_subtract: applied on struct type with name: {new_scm.get('name', 'top')}")
-    if len(new_scm['fields']) == 0:
-        return None
-    else:
-        return new_scm
+        disk_cache.touch(path)
+        return True, diff_text if suffix == _CACHE_DIFF_SUFFIX else None
+    return False, None
+
+def save_cached_diff(cache_dir, key, diff_text):
+    os.makedirs(cache_dir, exist_ok=True)
+    suffix = _CACHE_DIFF_SUFFIX if diff_text is not None else _CACHE_EMPTY_SUFFIX
+    target_writer.write_file(os.path.join(cache_dir, f"{key}{suffix}"), diff_text or "")
+
+def cached_subtract_schema_files(new_file_path, old_file_path, cache_dir=None, max_bytes=0, diff_format="yaml"):
+    """
+    Subtract 2 schema files, the result is cached in cache_dir if it is given.
+    return:
+        The schema diff dumped in YAML, None if there are no changes.
+    """
+    with open(new_file_path, 'rb') as new_file,\
+         open(old_file_path, 'rb') as old_file:
+        new_text = new_file.read()
+        old_text = old_file.read()
+    return cached_subtract_schema_texts(new_text, old_text, cache_dir, max_bytes, diff_format)
+
+def cached_subtract_schema_texts(new_text, old_text, cache_dir=None, max_bytes=0, diff_format="yaml"):
+    """
+    Subtract 2 versions of schema in YAML or JSON bytes, the result is cached in
+    cache_dir if it is given.
+    return:
+        The schema diff dumped in diff_format, None if there are no changes.
+    """
+    metrics.count("schema_bytes", len(new_text) + len(old_text))
+
+    if cache_dir is None:
+        return subtract_schema_text(new_text, old_text, diff_format)
+
+    key = schema_diff_cache_key(new_text, old_text, diff_format)
+    hit, diff_text = load_cached_diff(cache_dir, key)
+    if hit:
+        _LOGGER.info(f"Schema diff cache hit {key}")
+        metrics.count("diff_cache_hits")
+        return diff_text
+    metrics.count("diff_cache_misses")
+
+    diff_text = subtract_schema_text(new_text, old_text, diff_format)
+    save_cached_diff(cache_dir, key, diff_text)
+    disk_cache.evict(cache_dir, max_bytes, (_CACHE_DIFF_SUFFIX, _CACHE_EMPTY_SUFFIX))
+    return diff_text
+
+
+def read_schema_source(source):
+    """
+    Read a schema source, which is a file path or the content in bytes already.
+    """
+    if isinstance(source, bytes):
+        return source
+    with open(source, 'rb') as f:
+        return f.read()
+
+def subtract_pair(new_source, old_source, output_file, cache_dir=None, max_bytes=0, diff_format="yaml"):
+    """
+    Subtract a schema pair, the diff is written to output_file if there are changes.
+    return:
+        True if there are changes.
+    """
+    diff_text = cached_subtract_schema_texts(read_schema_source(new_source), read_schema_source(old_source),
+                                             cache_dir, max_bytes, diff_format)
+    if diff_text is None:
+        return False
+    _LOGGER.info(f"Saving added schemas to file {output_file}")
+    with open(output_file, "w") as of:
+        of.write(diff_text)
+    return True
+
+def subtract_pair_job(new_source, old_source, output_file, cache_dir, max_bytes, diff_format):
+    """
+    Worker function of subtract_pairs.
+    return:
+        The tuple of whether there are changes and the metrics of the pair.
+    """
+    # worker processes are reused, only report the metrics of this pair
+    metrics.reset()
+    changed = subtract_pair(new_source, old_source, output_file, cache_dir, max_bytes, diff_format)
+    return changed, metrics.snapshot()
+
+def subtract_pairs(pairs, jobs=1, cache_dir=None, max_bytes=0, diff_format="yaml"):
+    """
+    Subtract many (new source, old source, output file) pairs, they are spread across
+    a process pool of jobs workers.
+    return:
+        The list of whether each pair has changes, in the order of pairs.
+    """
+    if jobs <= 1 or len(pairs) <= 1:
+        return [subtract_pair(*pair, cache_dir, max_bytes, diff_format) for pair in pairs]
+
+    # imported lazily, it isn't cheap for the one-off serial runs
+    from concurrent.futures import ProcessPoolExecutor
+
+    results = []
+    with ProcessPoolExecutor(max_workers=min(jobs, len(pairs))) as executor:
+        futures = [executor.submit(subtract_pair_job, *pair, cache_dir, max_bytes, diff_format) for pair in pairs]
+        for future in futures:
+            changed, pair_metrics = future.result()
+            metrics.merge(pair_metrics)
+            results.append(changed)
+    return results
+
+def write_summary(summary_file, schemas, outputs, changes):
+    """
+    Log which schemas changed, and write the summary to summary_file in JSON if it is given.
+    """
+    summary = [{"schema": schema, "output": output, "changed": changed}
+               for schema, output, changed in zip(schemas, outputs, changes)]
+    _LOGGER.info(f"{sum(changes)} of {len(summary)} schemas are changed")
+    if summary_file:
+        with open(summary_file, "w") as f:
+            json.dump(summary, f, indent=2)
+            f.write("\n")
+
+def read_pairs_file(pairs_file):
+    """
+    Read "<new_version_file> <old_version_file> <output_file>" lines, empty lines and
+    lines starting with '#' are ignored.
+    """
+    pairs = []
+    with open(pairs_file) as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            pair = line.split()
+            if len(pair) != 3:
+                raise ValueError(f"{pairs_file}:{line_no}: expect <new_version_file> <old_version_file> <output_file>, but got {line}")
+            pairs.append(tuple(pair))
+    return pairs
+
+def list_dir_pairs(new_dir, old_dir, output_dir):
+    """
+    Pair every file of new_dir with the file of the same name in old_dir, files which
+    don't exist in old_dir are skipped.
+    """
+    pairs = []
+    for name in sorted(os.listdir(new_dir)):
+        new_file = os.path.join(new_dir, name)
+        if not os.path.isfile(new_file):
+            continue
+        old_file = os.path.join(old_dir, name)
+        if not os.path.isfile(old_file):
+            _LOGGER.warning(f"Skip {new_file}, it doesn't exist in {old_dir}")
+            continue
+        pairs.append((new_file, old_file, os.path.join(output_dir, name)))
+    return pairs
+
+def subtract_git_range(git_range, path, output_dir, cache_dir=None, max_bytes=0, jobs=1, summary_file=None,
+                       diff_format="yaml"):
+    """
+    Subtract the base and head versions of every schema file changed in git_range, and
+    write the non-empty diffs into output_dir named by the base name of schema files.
+    return:
+        The list of schema files whose diff is written. Files which are new in git_range
+        or have no new fields are not included.
+    """
+    with metrics.stage("git"):
+        base, head = git_blobs.resolve_range(git_range)
+        schema_files = git_blobs.changed_files(base, head, path)
+    _LOGGER.info(f"There are {len(schema_files)} schema files changed in {git_range}")
+    os.makedirs(output_dir, exist_ok=True)
+    pairs = []
+    subtracted_files = []
+    with metrics.stage("git"), git_blobs.BlobReader() as reader:
+        for schema_file in schema_files:
+            new_text = reader.read(head, schema_file)
+            old_text = reader.read(base, schema_file)
+            if old_text is None:
+                _LOGGER.warning(f"Skip {schema_file}, it doesn't exist in {base}")
+                continue
+            pairs.append((new_text, old_text, os.path.join(output_dir, os.path.basename(schema_file))))
+            subtracted_files.append(schema_file)
+    changes = subtract_pairs(pairs, jobs, cache_dir, max_bytes, diff_format)
+    write_summary(summary_file, subtracted_files, [output for _, _, output in pairs], changes)
+    return [schema_file for schema_file, changed in zip(subtracted_files, changes) if changed]
 
 
 def main(args):
+    metrics.reset()
+    cache_dir = None if args["--no-cache"] else args["--cache-dir"]
+    max_bytes = int(args["--cache-size"]) * 1024 * 1024
+    diff_format = args["--diff-format"]
+    if diff_format not in DIFF_FORMATS:
+        _LOGGER.error(f"Unsupported diff format {diff_format}, it should be one of {DIFF_FORMATS}")
+        return 1
+    if args["--git-range"]:
+        diffed_files = subtract_git_range(args["--git-range"], args["--path"], args["--output-dir"],
+                                          cache_dir, max_bytes, int(args["--jobs"]), args["--summary"], diff_format)
+        for schema_file in diffed_files:
+            print(schema_file)
+        metrics.report(args["--timings"], args["--metrics-out"])
+        return 0
+
+    if args["--pairs"] or args["--new-dir"]:
+        if args["--pairs"]:
+            pairs = read_pairs_file(args["--pairs"])
+        else:
+            os.makedirs(args["--output-dir"], exist_ok=True)
+            pairs = list_dir_pairs(args["--new-dir"], args["--old-dir"], args["--output-dir"])
+        changes = subtract_pairs(pairs, int(args["--jobs"]), cache_dir, max_bytes, diff_format)
+        write_summary(args["--summary"], [new for new, _, _ in pairs], [output for _, _, output in pairs], changes)
+        metrics.report(args["--timings"], args["--metrics-out"])
+        return 0
+
     _LOGGER.info(f'Input new schema file {args["<new_version_file>"]}')
     _LOGGER.info(f'Input base schema file {args["<old_version_file>"]}')
-    with open(args["<new_version_file>"]) as new_file,\
-         open(args["<old_version_file>"]) as old_file:
-
-         new_config = yaml.load(new_file, Loader=Loader)
-         old_config = yaml.load(old_file, Loader=Loader)
-
-         remains = schema_subtract(new_config, old_config)
-         _LOGGER.debug(f"The subtract results is {remains}")
-         if not is_empty_schema(remains):
-             with open(args["<output_file>"], "w") as of:
-                 _LOGGER.info(f'Saving added schemas to file {args["<output_file>"]}')
-                 yaml.dump(remains, of, sort_keys=False)
+    diff_text = cached_subtract_schema_files(args["<new_version_file>"], args["<old_version_file>"],
+                                             cache_dir, max_bytes, diff_format)
+    if diff_text is not None:
+        with open(args["<output_file>"], "w") as of:
+            _LOGGER.info(f'Saving added schemas to file {args["<output_file>"]}')
+            of.write(diff_text)
+    metrics.report(args["--timings"], args["--metrics-out"])
 
 if __name__ == "__main__":
     logging.basicConfig(
@@ -0,0 +1,178 @@
+'''
+Walks over the spark schemas loaded from YAML, shared by the automation scripts.
+
+The schema dicts are walked as they are, iteratively, a one-off walk doesn't pay for
+building a model of them first. schema_history keeps its own tree of the versions,
+see history_tree.
+
+subtract can skip the struct subtrees which are the same in both versions by their
+subtree hashes, see subtree_hashes. Computing the hashes costs a full walk, thus
+they pay off only when they are computed once per schema content and loaded from
+the yaml_loader snapshots afterwards, e.g. an old version subtracted from many new
+ones, or every version of a git range which is the old and the new side of a pair.
+'''
+import hashlib
+
+import metrics
+
+_KEY_NAME       = "name"
+_KEY_TYPE       = "type"
+_KEY_FIELDS     = "fields"
+_KEY_ELEMENT    = "elementType"
+_TYPE_STRUCT    = "struct"
+
+# bump it when the subtree hashes change, cached hashes of other versions are not used
+SUBTREE_HASH_VERSION = 1
+
+
+def leaves(schema):
+    """
+    Iterate over the leaf fields of a schema dict depth first, struct and array of
+    struct fields are expanded.
+    return:
+        Iterator of (path, field), path is a tuple of (name, is_array) segments from
+        the top level down to the leaf field itself, field is the field dict.
+    >>> schema = {'type': 'struct', 'fields': [
+    ...     {'name': 'a', 'type': {'type': 'array', 'elementType': {'type': 'struct', 'fields': [
+    ...         {'name': 'b', 'type': 'long'},
+    ...         {'name': 'c', 'type': {'type': 'array', 'elementType': 'string'}}]}}},
+    ...     {'name': 'd', 'type': 'string'}]}
+    >>> [path for path, field in leaves(schema)]
+    [(('a', True), ('b', False)), (('a', True), ('c', True)), (('d', False),)]
+    """
+    stack = [((), iter(schema[_KEY_FIELDS]))]
+    while stack:
+        parent_path, fields = stack[-1]
+        for field in fields:
+            field_type = field[_KEY_TYPE]
+            if isinstance(field_type, str):
+                yield parent_path + ((field[_KEY_NAME], False),), field
+            elif isinstance(field_type, dict) and _KEY_ELEMENT in field_type:
+                path = parent_path + ((field[_KEY_NAME], True),)
+                element = field_type[_KEY_ELEMENT]
+                if isinstance(element, dict):
+                    assert element.get(_KEY_TYPE) == _TYPE_STRUCT, 'array in array type is not supported yet!'
+                    stack.append((path, iter(element[_KEY_FIELDS])))
+                    break
+                yield path, field
+            elif isinstance(field_type, dict) and field_type.get(_KEY_TYPE) == _TYPE_STRUCT:
+                stack.append((parent_path + ((field[_KEY_NAME], False),), iter(field_type[_KEY_FIELDS])))
+                break
+            else:
+                raise Exception(f"Unsupported schema element type: {field_type}!")
+        else:
+            stack.pop()
+
+
+def subtree_hashes(schema):
+    """
+    Hash every struct of a schema dict, the root and the ones under struct fields or
+    arrays, bottom-up in one pass. The hashes cover the field names and types only,
+    like subtract does, keys which are not modeled (nullable, metadata ...) and the
+    key order of type dicts don't take part.
+    return:
+        Dict of the path of a struct, a tuple of the field names from the top level
+        down to it, to its hash. The hash is None for paths which aren't unique
+        because of duplicated names.
+    >>> a = {'type': 'struct', 'fields': [{'name': 'a', 'nullable': True,
+    ...     'type': {'type': 'array', 'elementType': {'type': 'struct', 'fields': [{'name': 'b', 'type': 'long'}]}}}]}
+    >>> b = {'type': 'struct', 'fields': [{'name': 'a',
+    ...     'type': {'elementType': {'type': 'struct', 'fields': [{'name': 'b', 'type': 'long'}]}, 'type': 'array'}}]}
+    >>> c = {'type': 'struct', 'fields': [{'name': 'a',
+    ...     'type': {'type': 'array', 'elementType': {'type': 'struct', 'fields': [{'name': 'b', 'type': 'int'}]}}}]}
+    >>> sorted(subtree_hashes(a))
+    [(), ('a',)]
+    >>> subtree_hashes(a) == subtree_hashes(b), subtree_hashes(a)[('a',)] == subtree_hashes(c)[('a',)]
+    (True, False)
+    """
+    hashes = {}
+    struct_hash(schema, (), hashes)
+    return hashes
+
+def struct_hash(struct, path, hashes):
+    digest = hashlib.blake2b(digest_size=16)
+    for f in struct.get(_KEY_FIELDS, ()):
+        name = f[_KEY_NAME]
+        digest.update(f"{name}\0{type_hash(f[_KEY_TYPE], path + (name,), hashes)}\0".encode())
+    struct_digest = digest.hexdigest()
+    # the first one wins for duplicated names in subtract, the hashes can't tell which
+    hashes[path] = None if path in hashes else struct_digest
+    return struct_digest
+
+def type_hash(field_type, path, hashes):
+    # the prefixes keep arrays, structs and other type dicts apart from type names
+    if isinstance(field_type, dict):
+        if _KEY_ELEMENT in field_type:
+            return f"[{type_hash(field_type[_KEY_ELEMENT], path, hashes)}"
+        if field_type.get(_KEY_TYPE) == _TYPE_STRUCT:
+            return f"#{struct_hash(field_type, path, hashes)}"
+        return f"{{{sorted(field_type.items())!r}"
+    return field_type
+
+def subtract(new_scm, old_scm, new_hashes=None, old_hashes=None):
+    """
+    Subtract 2 versions of schema dicts loaded from YAML. The inputs are left
+    untouched, the result shares the unchanged dicts of new_scm. Given the
+    subtree_hashes of both, the structs with the same hash in both versions are
+    skipped without descending into them.
+    return:
+        The schema dict of the new fields, None if there are no changes.
+    >>> new = {'type': 'struct', 'fields': [{'name': 'a', 'type': 'long'},
+    ...     {'name': 'b', 'type': {'type': 'array', 'elementType': {'type': 'struct', 'fields': [
+    ...         {'name': 'c', 'type': 'string'}, {'name': 'd', 'type': 'long'}]}}}]}
+    >>> old = {'type': 'struct', 'fields': [{'name': 'a', 'type': 'long'},
+    ...     {'name': 'b', 'type': {'type': 'array', 'elementType': {'type': 'struct', 'fields': [
+    ...         {'name': 'c', 'type': 'string'}]}}}]}
+    >>> subtract(new, old)['fields']
+    [{'name': 'b', 'type': {'type': 'array', 'elementType': {'type': 'struct', 'fields': [{'name': 'd', 'type': 'long'}]}}}]
+    >>> subtract(new, old, subtree_hashes(new), subtree_hashes(old)) == subtract(new, old)
+    True
+    >>> subtract(new, new) is None, subtract(new, new, subtree_hashes(new), subtree_hashes(new)) is None
+    (True, True)
+    """
+    hashes = None
+    if new_hashes is not None and old_hashes is not None:
+        hashes = (new_hashes, old_hashes)
+    return subtract_struct(new_scm, old_scm, (), hashes)
+
+def subtract_struct(new_scm, old_scm, path, hashes):
+    assert isinstance(old_scm, dict) and old_scm.get(_KEY_TYPE) == _TYPE_STRUCT, \
+        f"schema_subtract: old schema must be struct type, but it is {old_scm}"
+    if hashes is not None:
+        new_hash = hashes[0].get(path)
+        if new_hash is not None and new_hash == hashes[1].get(path):
+            metrics.count("subtrees_skipped")
+            return None
+    old_index = {}
+    for f in old_scm.get(_KEY_FIELDS, ()):
+        # the first one wins for duplicated names
+        old_index.setdefault(f[_KEY_NAME], f)
+    new_fields = new_scm.get(_KEY_FIELDS, ())
+    fields = []
+    for f in new_fields:
+        name = f[_KEY_NAME]
+        old_field = old_index.get(name)
+        if old_field is None:
+            # didn't find the name
+            fields.append(f)
+            continue
+        res = subtract_type(f[_KEY_TYPE], old_field[_KEY_TYPE], path + (name,), hashes)
+        if res is not None:
+            fields.append({**f, _KEY_TYPE: res})
+    metrics.count("fields_compared", len(new_fields))
+    if len(fields) == 0:
+        return None
+    return {**new_scm, _KEY_FIELDS: fields}
+
+def subtract_type(new_type, old_type, path, hashes):
+    if isinstance(new_type, dict):
+        if _KEY_ELEMENT in new_type:
+            assert isinstance(old_type, dict) and _KEY_ELEMENT in old_type, f"schema_subtract: the old schema should be array type"
+            res = subtract_type(new_type[_KEY_ELEMENT], old_type[_KEY_ELEMENT], path, hashes)
+            return None if res is None else {**new_type, _KEY_ELEMENT: res}
+        if new_type.get(_KEY_TYPE) == _TYPE_STRUCT:
+            assert isinstance(old_type, dict), f"schema_subtract: the old schema should be struct type"
+            return subtract_struct(new_type, old_type, path, hashes)
+    # for POD and other types
+    assert new_type == old_type, f"schema_subtract: pod types must be matched, but get {new_type} VS {old_type}"
+    return None
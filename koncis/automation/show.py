@@ -4,33 +4,60 @@ This application will try to print filepath/info for given components based on s
 
 Usage:
     show.py (-h | --help)
-    show.py column_files [--schema-config=<config_file>] <schema_file>
-    show.py column_trans [--schema-config=<config_file>] <schema_file>
-    show.py fixtures [--schema-config=<config_file>] <schema_file>
-    show.py sql_templates [--schema-config=<config_file>] <schema_file>
-    show.py litepipe [--schema-config=<config_file>] <schema_file>
-    show.py iceberg_tables [--schema-config=<config_file>] <schema_file>
+    show.py column_files [--timings] [--metrics-out=<metrics_file>] [--schema-config=<config_file>] <schema_file>
+    show.py column_trans [--timings] [--metrics-out=<metrics_file>] [--schema-config=<config_file>] <schema_file>
+    show.py fixtures [--timings] [--metrics-out=<metrics_file>] [--schema-config=<config_file>] <schema_file>
+    show.py sql_templates [--timings] [--metrics-out=<metrics_file>] [--schema-config=<config_file>] <schema_file>
+    show.py litepipe [--timings] [--metrics-out=<metrics_file>] [--schema-config=<config_file>] <schema_file>
+    show.py iceberg_tables [--timings] [--metrics-out=<metrics_file>] [--schema-config=<config_file>] <schema_file>
+    show.py all [--timings] [--metrics-out=<metrics_file>] [--schema-config=<config_file>] [--format=<format>] <schema_files>...
 
 Options:
     -h, --help                          Print this screen and exit.
     <schema_file>                       The schema file path whose content has changed.
+    <schema_files>                      The schema file paths whose content has changed, every
+                                        component of them are printed in one manifest.
     --schema-config=<config_file>       Specify the schema config file path
                                         [default: automation/schema_config.yaml]
+    --format=<format>                   Specify the manifest format, "text" prints one
+                                        "<schema_file> <component> <value>" line per value,
+                                        "json" prints a json object keyed by schema file.
+                                        [default: text]
+    --timings                           Log the wall time of each stage and the counters at last.
+    --metrics-out=<metrics_file>        Write the wall time of each stage and the counters, e.g.
+                                        printed values and yaml cache hits, to file in JSON.
 '''
 
 from docopt import docopt
 import sys
+import json
 import logging
 
-import yaml
-try:
-    from yaml import CLoader as Loader, CDumper as Dumper
-except ImportError:
-    from yaml import Loader, Dumper
+import metrics
+import yaml_loader
 
 _LOGGER     = logging.getLogger('show.py')
 
+# the last indexed configs and its index, see index_schema_configs
+_schema_config_index = (None, {})
+
 # util functions
+def index_schema_configs(configs):
+    """
+    Get the index of schema configs keyed by schema file path, the first one wins
+    for duplicated file paths. The index of the last configs is kept for reuse.
+    """
+    global _schema_config_index
+    indexed_configs, index = _schema_config_index
+    if indexed_configs is configs:
+        return index
+
+    index = {}
+    for conf in configs['schemas']:
+        index.setdefault(conf['file'], conf)
+    _schema_config_index = (configs, index)
+    return index
+
 def get_schema_config(configs, schema_file_path):
     """
     Get schema config for the specific schema, which is identified by the
@@ -43,16 +70,21 @@ def get_schema_config(configs, schema_file_path):
     return:
         Python dict of the config of the specific schema.
     """
-    for conf in configs['schemas']:
-        _LOGGER.debug(f'Checking schema {conf["name"]} in file {conf["file"]}')
-        if conf['file'] == schema_file_path:
-            _LOGGER.debug(f'schema {conf["name"]} matched {schema_file_path}, return it!')
-            return conf
-    return None
+    conf = index_schema_configs(configs).get(schema_file_path)
+    if conf is not None:
+        _LOGGER.debug('schema %s matched %s, return it!', conf["name"], schema_file_path)
+    return conf
+
+def safe_list(data, key):
+    # empty entries in schema config are loaded as None
+    values = data.get(key)
+    if values is None:
+        return []
+    return values
 
 def parse_schema_fixtures(config):
-    fixtures = [f"{path}::" for path in config["ci_fixture"]]
-    fixtures_derived = [f"{conf['file']}:derived:{safe_suffix(conf, 'col_suffix')}" for conf in config["ci_fixture_derived"]]
+    fixtures = [f"{path}::" for path in safe_list(config, "ci_fixture")]
+    fixtures_derived = [f"{conf['file']}:derived:{safe_suffix(conf, 'col_suffix')}" for conf in safe_list(config, "ci_fixture_derived")]
     fixtures.extend(fixtures_derived)
     return fixtures
 
@@ -64,23 +96,23 @@ def safe_suffix(data, suffix_key):
 
 
 def parse_schema_sql_templates(config):
-    template_list = config["iceberg_table_schemas"]
+    template_list = safe_list(config, "iceberg_table_schemas")
     return [f'{d["file"]}:{safe_suffix(d, "col_suffix")}' for d in template_list]
 
 def parse_schema_column_files(config):
-    return config["col_files"]
+    return safe_list(config, "col_files")
 
 def parse_schema_column_mapping_files(config):
-    return config["col_mappings"]
+    return safe_list(config, "col_mappings")
 
 def parse_schema_related_litepipes(config):
-    return config["litepipes"]
+    return safe_list(config, "litepipes")
 
 def parse_iceberg_tables_spec(config):
-    tables_list = config["iceberg_table_schemas"]
+    tables_list = safe_list(config, "iceberg_table_schemas")
     results = []
     for conf in tables_list:
-        _LOGGER.info(f"Process {conf['file']}")
+        _LOGGER.debug("Process %s", conf['file'])
         tables = conf.get("prod_tables", [])
         if tables:
             col_suffix = safe_suffix(conf, "col_suffix")
@@ -89,13 +121,16 @@ def parse_iceberg_tables_spec(config):
 
 # wrapper functions
 def print_list(str_list):
+    count = 0
     for s in str_list:
-        _LOGGER.debug(f"print_list output: '{s}'")
+        _LOGGER.debug("print_list output: '%s'", s)
         print(s)
+        count += 1
+    metrics.count("printed_values", count)
 
 def load_schema_config(schema_config_path):
-    with open(schema_config_path) as f:
-        return yaml.safe_load(f)
+    with metrics.stage("load_schema_config"):
+        return yaml_loader.load_yaml(schema_config_path)
 
 
 def show_fixtures(schema_path, schema_config_path):
@@ -128,12 +163,58 @@ def show_iceberg_table_specs(schema_path, schema_config_path):
     config = get_schema_config(schema_config, schema_path)
     print_list(parse_iceberg_tables_spec(config))
 
+# component name to parse function, the names are the same with sub commands
+COMPONENT_PARSERS = {
+    "column_files":     parse_schema_column_files,
+    "column_trans":     parse_schema_column_mapping_files,
+    "fixtures":         parse_schema_fixtures,
+    "sql_templates":    parse_schema_sql_templates,
+    "iceberg_tables":   parse_iceberg_tables_spec,
+    "litepipe":         parse_schema_related_litepipes,
+}
+
+def build_manifest(schema_config, schema_paths):
+    """
+    Build the manifest of every component for schema files.
+    return:
+        Dict keyed by schema file path, the value is a dict of component name to
+        the list of values, or None if the schema isn't configured.
+    """
+    manifest = {}
+    for schema_path in schema_paths:
+        config = get_schema_config(schema_config, schema_path)
+        if config is None:
+            _LOGGER.warning(f"No schema config found for {schema_path}")
+            manifest[schema_path] = None
+            continue
+        manifest[schema_path] = {name: list(parse(config)) for name, parse in COMPONENT_PARSERS.items()}
+    return manifest
+
+def show_all(schema_paths, schema_config_path, output_format):
+    schema_config = load_schema_config(schema_config_path)
+    with metrics.stage("build_manifest"):
+        manifest = build_manifest(schema_config, schema_paths)
+    if output_format == "json":
+        print(json.dumps(manifest, indent=2))
+        return
+    for schema_path, components in manifest.items():
+        if components is None:
+            continue
+        for name, values in components.items():
+            print_list([f"{schema_path} {name} {value}" for value in values])
+
 
 def main(args):
     logging.basicConfig(
         format='%(asctime)s %(name)s[%(levelname)s]: %(message)s',
         level=logging.INFO
     )
+    metrics.reset()
+    exit_code = run_command(args)
+    metrics.report(args["--timings"], args["--metrics-out"])
+    return exit_code
+
+def run_command(args):
     if args["fixtures"]:
         show_fixtures(args["<schema_file>"], args["--schema-config"])
         return 0
@@ -152,6 +233,12 @@ def main(args):
     if args["iceberg_tables"]:
         show_iceberg_table_specs(args["<schema_file>"], args["--schema-config"])
         return 0
+    if args["all"]:
+        if args["--format"] not in ("text", "json"):
+            _LOGGER.error(f'Unsupported manifest format {args["--format"]}')
+            return 1
+        show_all(args["<schema_files>"], args["--schema-config"], args["--format"])
+        return 0
 
 if __name__ == "__main__":
     sys.exit(main(docopt(__doc__)))
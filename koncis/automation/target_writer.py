@@ -0,0 +1,234 @@
+'''
+Writers of the target files of propagate.py.
+
+A target is only replaced when its new content differs from the content on disk,
+so unchanged files keep their mtime and don't invalidate incremental builds and
+test caches.
+
+In dry run mode nothing is written, the new contents are kept in memory instead,
+later reads of the same target see them, and report_dry_run prints a unified diff
+of every changed target at last.
+'''
+import io
+import os
+import sys
+import shutil
+import difflib
+import filecmp
+import logging
+import tempfile
+
+import metrics
+
+_LOGGER     = logging.getLogger('target_writer.py')
+
+_dry_run    = False
+# normalized path to the new content in dry run mode, str for text and bytes for binary files
+_overlay    = {}
+
+
+def set_dry_run(enabled):
+    global _dry_run
+    _dry_run = bool(enabled)
+    _overlay.clear()
+
+def is_dry_run():
+    return _dry_run
+
+def target_key(file_path):
+    return os.path.normpath(file_path)
+
+def read_text(file_path):
+    content = _overlay.get(target_key(file_path))
+    if content is not None:
+        return content
+    with open(file_path) as f:
+        return f.read()
+
+def open_text(file_path):
+    """
+    Open a target file for reading lines, the new content is read in dry run mode.
+    """
+    content = _overlay.get(target_key(file_path))
+    if content is not None:
+        return io.StringIO(content)
+    return open(file_path)
+
+def read_bytes(file_path):
+    """
+    Get the new content of a binary target in dry run mode, None if it is not changed.
+    """
+    content = _overlay.get(target_key(file_path))
+    return content if isinstance(content, bytes) else None
+
+def mkstemp_next_to(file_path, suffix=".tmp"):
+    dir_name = os.path.dirname(os.path.abspath(file_path))
+    return tempfile.mkstemp(dir=dir_name, prefix=f".{os.path.basename(file_path)}.", suffix=suffix)
+
+def is_same_file(file_path, other_path):
+    try:
+        return filecmp.cmp(file_path, other_path, shallow=False)
+    except FileNotFoundError:
+        return False
+
+def current_bytes(file_path):
+    """
+    The current content of a target in bytes, the new content in dry run mode, None if
+    the file doesn't exist.
+    """
+    content = _overlay.get(target_key(file_path))
+    if isinstance(content, str):
+        return content.encode()
+    if content is not None:
+        return content
+    try:
+        with open(file_path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def keep_in_overlay(file_path, tmp_path):
+    """
+    Keep the content of the written temp file in memory for dry run mode.
+    return:
+        True if the content is changed.
+    """
+    with open(tmp_path, 'rb') as f:
+        content = f.read()
+    os.unlink(tmp_path)
+    if content == current_bytes(file_path):
+        return False
+    try:
+        _overlay[target_key(file_path)] = content.decode()
+    except UnicodeDecodeError:
+        _overlay[target_key(file_path)] = content
+    return True
+
+def replace_file(file_path, tmp_path):
+    """
+    Replace file_path by the written temp file at once, the mode of file_path is kept.
+    The temp file is removed on failures.
+    """
+    try:
+        if os.path.exists(file_path):
+            shutil.copymode(file_path, tmp_path)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+def write_file(file_path, content):
+    """
+    Write str or bytes content to a file which is not a target, e.g. caches and
+    manifests, through a temp file next to it, thus a crash in the middle never leaves
+    a truncated file. Such files are written in dry run mode too.
+    """
+    fd, tmp_path = mkstemp_next_to(file_path)
+    try:
+        with os.fdopen(fd, 'wb' if isinstance(content, bytes) else 'w') as f:
+            f.write(content)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    replace_file(file_path, tmp_path)
+
+def replace_target(file_path, tmp_path):
+    """
+    Replace file_path by the written temp file if their contents differ, otherwise the
+    temp file is removed. In dry run mode the temp file is kept in memory and removed.
+    return:
+        True if the content is changed.
+    """
+    try:
+        if _dry_run:
+            changed = keep_in_overlay(file_path, tmp_path)
+        elif is_same_file(file_path, tmp_path):
+            os.unlink(tmp_path)
+            changed = False
+        else:
+            replace_file(file_path, tmp_path)
+            changed = True
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    if changed:
+        metrics.count("files_written")
+    else:
+        _LOGGER.info(f"{file_path} is not changed, leave it alone")
+        metrics.count("files_unchanged")
+    return changed
+
+def write_lines(file_path, lines):
+    """
+    Stream lines into a temp file in the same directory of file_path, then replace
+    file_path with it if the content is changed, thus a crash in the middle never
+    leaves a truncated file.
+    return:
+        The number of written lines.
+    """
+    fd, tmp_path = mkstemp_next_to(file_path)
+    try:
+        count = 0
+        with os.fdopen(fd, 'w') as f:
+            for line in lines:
+                f.write(line)
+                count += 1
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    replace_target(file_path, tmp_path)
+    return count
+
+def write_text(file_path, content):
+    """
+    Write content to file_path if it differs from the current content.
+    return:
+        True if the content is changed.
+    """
+    key = target_key(file_path)
+    if key in _overlay or os.path.exists(file_path):
+        if read_text(file_path) == content:
+            _LOGGER.info(f"{file_path} is not changed, leave it alone")
+            metrics.count("files_unchanged")
+            return False
+    if _dry_run:
+        _overlay[key] = content
+    else:
+        write_file(file_path, content)
+    metrics.count("files_written")
+    return True
+
+def diff_lines(lines):
+    # keep the unified diff well formed for the last line without a newline
+    return [l if l.endswith("\n") else f"{l}\n\\ No newline at end of file\n" for l in lines]
+
+def unified_diff(file_path, new_content):
+    """
+    Unified diff of a target file from its content on disk to new_content.
+    >>> print(''.join(unified_diff('missing/a.txt', 'x\\n')), end='')
+    --- a/missing/a.txt
+    +++ b/missing/a.txt
+    @@ -0,0 +1 @@
+    +x
+    """
+    if isinstance(new_content, bytes):
+        return [f"Binary file {file_path} would be changed\n"]
+    try:
+        with open(file_path) as f:
+            old_lines = f.readlines()
+    except FileNotFoundError:
+        old_lines = []
+    new_lines = new_content.splitlines(keepends=True)
+    return diff_lines(difflib.unified_diff(old_lines, new_lines, fromfile=f"a/{file_path}", tofile=f"b/{file_path}"))
+
+def report_dry_run(out=None):
+    """
+    Print the unified diff of every target changed in dry run mode, in the order they
+    were first changed.
+    """
+    out = out or sys.stdout
+    for file_path, content in _overlay.items():
+        out.writelines(unified_diff(file_path, content))
+    _LOGGER.info(f"{len(_overlay)} files would be changed")
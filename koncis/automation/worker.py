@@ -0,0 +1,125 @@
+#! /usr/bin/env python
+'''
+This application runs a persistent koncis worker, which accepts JSON-lines requests
+and keeps parsed configs and compiled schema diffs warm between requests.
+
+Every request is a JSON object in a single line:
+    {"id": 1, "command": "propagate", "args": ["fixture", "--diff=.auto/a.yaml", "a.txt::"]}
+"command" is one of subtract, show and propagate, "args" are the same arguments of
+schema_subtract.py, show.py and propagate.py. Every response is a JSON object in a
+single line:
+    {"id": 1, "ok": true, "exit_code": 0, "stdout": "...", "error": null}
+Requests are handled one by one, relative paths are resolved from the working
+directory of the worker.
+
+Usage:
+    worker.py (-h | --help)
+    worker.py [--socket=<socket_path>]
+
+Options:
+    -h, --help                  Print this screen and exit.
+    --socket=<socket_path>      Serve requests on the given local unix socket, otherwise
+                                read requests from stdin and write responses to stdout.
+'''
+
+from docopt import docopt
+import io
+import os
+import sys
+import json
+import socket
+import logging
+import importlib
+import contextlib
+
+_LOGGER     = logging.getLogger('worker.py')
+
+# request command to the module name of the tool
+TOOLS = {
+    "subtract":     "schema_subtract",
+    "show":         "show",
+    "propagate":    "propagate",
+}
+
+
+def load_tool(command):
+    # tools are imported on the first request, so the worker starts fast
+    if command not in TOOLS:
+        raise ValueError(f"Unsupported command {command}, it should be one of {sorted(TOOLS)}")
+    import yaml_loader
+    yaml_loader.enable_memory_cache()
+    return importlib.import_module(TOOLS[command])
+
+def run_tool(command, argv):
+    """
+    Run the main function of a tool with command line arguments.
+    return:
+        A tuple of exit code and the captured stdout.
+    """
+    tool = load_tool(command)
+    stdout = io.StringIO()
+    with contextlib.redirect_stdout(stdout):
+        try:
+            exit_code = tool.main(docopt(tool.__doc__, argv=argv, help=False))
+        except SystemExit as e:
+            # docopt exits with the usage message for bad arguments
+            if isinstance(e.code, str):
+                raise ValueError(e.code)
+            exit_code = e.code
+    return exit_code or 0, stdout.getvalue()
+
+def handle_request(line):
+    request_id = None
+    try:
+        request = json.loads(line)
+        request_id = request.get("id")
+        exit_code, stdout = run_tool(request["command"], request.get("args", []))
+        return {"id": request_id, "ok": exit_code == 0, "exit_code": exit_code, "stdout": stdout, "error": None}
+    except Exception as e:
+        _LOGGER.exception(f"Failed to handle request {line.strip()}")
+        return {"id": request_id, "ok": False, "exit_code": 1, "stdout": "", "error": f"{type(e).__name__}: {e}"}
+
+def serve(reader, writer):
+    for line in reader:
+        if not line.strip():
+            continue
+        writer.write(json.dumps(handle_request(line)))
+        writer.write("\n")
+        writer.flush()
+
+def serve_socket(socket_path):
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen()
+    _LOGGER.info(f"Serving on {socket_path}")
+    try:
+        while True:
+            conn, _ = server.accept()
+            # an error of one connection, e.g. the client went away or sent bytes which
+            # aren't UTF-8, only drops that connection
+            try:
+                with conn, conn.makefile('r') as reader, conn.makefile('w') as writer:
+                    serve(reader, writer)
+            except (OSError, ValueError) as e:
+                _LOGGER.warning(f"Drop the connection: {type(e).__name__}: {e}")
+    finally:
+        server.close()
+        os.unlink(socket_path)
+
+
+def main(args):
+    logging.basicConfig(
+        format='%(asctime)s %(name)s[%(levelname)s]: %(message)s',
+        level=logging.INFO
+    )
+    if args["--socket"]:
+        serve_socket(args["--socket"])
+    else:
+        serve(sys.stdin, sys.stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(docopt(__doc__)))
@@ -0,0 +1,217 @@
+'''
+Shared YAML loading layer of the automation scripts.
+
+YAML files are parsed by the C safe loader when libyaml is available, and the
+parsed result is kept as a pickled snapshot in a cache directory, thus loading
+an unchanged file again skips YAML parsing completely.
+
+A snapshot is valid when the mtime and size of the file match, or when the
+content hash of the file matches (e.g. the file is touched by a git checkout).
+The cache directory is taken from the KONCIS_YAML_CACHE environment variable,
+set it to empty string to disable the snapshots. The snapshots are bounded by
+KONCIS_YAML_CACHE_SIZE in MB, least recently used ones are evicted beyond it.
+
+Schema contents, e.g. git blobs, get snapshots keyed by the content hash, which keep
+the schema_tree.subtree_hashes along with the parsed schema, thus the hashes are
+computed once per schema content.
+
+JSON files, e.g. spark schemas saved by df.schema.json(), are detected by the
+.json extension or by content sniffing, and parsed by the much faster json module.
+
+Long running processes (e.g. worker.py) can also enable the in-memory cache,
+which returns the same parsed object while the file is unchanged, so callers
+must not modify it.
+'''
+import os
+import json
+import pickle
+import hashlib
+import logging
+
+import yaml
+import metrics
+import disk_cache
+import schema_tree
+import target_writer
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+_LOGGER     = logging.getLogger('yaml_loader.py')
+
+CACHE_DIR_ENV       = "KONCIS_YAML_CACHE"
+DEFAULT_CACHE_DIR   = ".auto/cache/yaml"
+CACHE_SIZE_ENV      = "KONCIS_YAML_CACHE_SIZE"
+# in MB
+DEFAULT_CACHE_SIZE  = 64
+
+# bump it when the snapshot layout changes
+_SNAPSHOT_VERSION   = 1
+_SNAPSHOT_SUFFIX    = ".pickle"
+
+# absolute path to (mtime, size, data), None if the in-memory cache is disabled
+_memory_cache       = None
+
+
+def enable_memory_cache():
+    global _memory_cache
+    if _memory_cache is None:
+        _memory_cache = {}
+
+def get_cache_dir():
+    """
+    Get the snapshot cache directory, None if the snapshots are disabled.
+    """
+    cache_dir = os.environ.get(CACHE_DIR_ENV, DEFAULT_CACHE_DIR)
+    if not cache_dir:
+        return None
+    return cache_dir
+
+def get_cache_max_bytes():
+    return int(os.environ.get(CACHE_SIZE_ENV, DEFAULT_CACHE_SIZE)) * 1024 * 1024
+
+def is_json_path(path):
+    return path is not None and os.path.splitext(path)[1].lower() == ".json"
+
+def looks_like_json(content, path=None):
+    """
+    Detect JSON content by the .json extension of path, or by the first non-blank
+    character of content.
+    >>> looks_like_json(b' {"type": "struct"}'), looks_like_json('type: struct'), looks_like_json('', 'a.JSON')
+    (True, False, True)
+    """
+    if is_json_path(path):
+        return True
+    head = content[:64].lstrip()[:1]
+    return head in (b"{", "{")
+
+def parse_document(content, path=None, loader=SafeLoader):
+    """
+    Parse YAML or JSON content, JSON is detected by looks_like_json and parsed by the
+    json module. Content which isn't valid JSON (e.g. a YAML flow mapping, or a YAML
+    schema diff named after a .json schema file) is parsed as YAML, which is a superset
+    of JSON anyway.
+    >>> parse_document('{a: 1}'), parse_document(b'{"a": [1]}'), parse_document('a: 1', 'a.json')
+    ({'a': 1}, {'a': [1]}, {'a': 1})
+    """
+    if looks_like_json(content, path):
+        try:
+            return json.loads(content)
+        except ValueError:
+            _LOGGER.debug("%s is not valid JSON, parse it as YAML", path or "content")
+    return yaml.load(content, Loader=loader)
+
+def snapshot_path(cache_dir, path):
+    name = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()
+    return os.path.join(cache_dir, f"{name}{_SNAPSHOT_SUFFIX}")
+
+def read_snapshot(snapshot_file):
+    try:
+        with open(snapshot_file, 'rb') as f:
+            snapshot = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        _LOGGER.warning(f"Ignore broken yaml snapshot {snapshot_file}: {e}")
+        return None
+    if snapshot.get("version") != _SNAPSHOT_VERSION:
+        return None
+    return snapshot
+
+def write_snapshot(snapshot_file, snapshot):
+    cache_dir = os.path.dirname(snapshot_file)
+    os.makedirs(cache_dir, exist_ok=True)
+    target_writer.write_file(snapshot_file, pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL))
+    disk_cache.evict(cache_dir, get_cache_max_bytes(), (_SNAPSHOT_SUFFIX,))
+
+def load_schema_content(content, cache_dir=None, loader=SafeLoader):
+    """
+    Parse a schema in YAML or JSON content with its schema_tree.subtree_hashes, both are
+    kept as a snapshot keyed by the content hash in cache_dir (default from
+    get_cache_dir).
+    return:
+        A tuple of (schema, hashes), hashes is None if the snapshots are disabled, the
+        hashes don't pay for themselves when they are used only once.
+    """
+    if cache_dir is None:
+        cache_dir = get_cache_dir()
+    if cache_dir is None:
+        metrics.count("yaml_parses")
+        return parse_document(content, loader=loader), None
+
+    content_hash = hashlib.sha256(content.encode() if isinstance(content, str) else content).hexdigest()
+    name = hashlib.sha256(f"schema:{schema_tree.SUBTREE_HASH_VERSION}:{content_hash}".encode()).hexdigest()
+    snapshot_file = os.path.join(cache_dir, f"{name}{_SNAPSHOT_SUFFIX}")
+    snapshot = read_snapshot(snapshot_file)
+    if snapshot and snapshot["hash"] == content_hash:
+        metrics.count("yaml_snapshot_hits")
+        disk_cache.touch(snapshot_file)
+        return snapshot["data"], snapshot["hashes"]
+
+    metrics.count("yaml_parses")
+    data = parse_document(content, loader=loader)
+    with metrics.stage("subtree_hashes"):
+        hashes = schema_tree.subtree_hashes(data)
+    write_snapshot(snapshot_file, {
+        "version": _SNAPSHOT_VERSION,
+        "hash": content_hash,
+        "data": data,
+        "hashes": hashes,
+    })
+    return data, hashes
+
+def load_yaml(path, cache_dir=None):
+    """
+    Load YAML or JSON file in the same way of yaml.safe_load, the parsed result is cached
+    as snapshot in cache_dir (default from get_cache_dir), and in memory if it is
+    enabled.
+    """
+    if _memory_cache is None:
+        return load_yaml_snapshot(path, cache_dir)
+
+    key = os.path.abspath(path)
+    stat = os.stat(path)
+    cached = _memory_cache.get(key)
+    if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        metrics.count("yaml_memory_hits")
+        return cached[2]
+    data = load_yaml_snapshot(path, cache_dir)
+    _memory_cache[key] = (stat.st_mtime_ns, stat.st_size, data)
+    return data
+
+def load_yaml_snapshot(path, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = get_cache_dir()
+    if cache_dir is None:
+        metrics.count("yaml_parses")
+        with open(path, 'rb') as f:
+            return parse_document(f.read(), path)
+
+    stat = os.stat(path)
+    snapshot_file = snapshot_path(cache_dir, path)
+    snapshot = read_snapshot(snapshot_file)
+    if snapshot and snapshot["mtime"] == stat.st_mtime_ns and snapshot["size"] == stat.st_size:
+        _LOGGER.debug("yaml snapshot hit by mtime for %s", path)
+        metrics.count("yaml_snapshot_hits")
+        disk_cache.touch(snapshot_file)
+        return snapshot["data"]
+
+    with open(path, 'rb') as f:
+        content = f.read()
+    content_hash = hashlib.sha256(content).hexdigest()
+    if snapshot and snapshot["hash"] == content_hash:
+        _LOGGER.debug("yaml snapshot hit by content hash for %s", path)
+        metrics.count("yaml_snapshot_hits")
+        data = snapshot["data"]
+    else:
+        metrics.count("yaml_parses")
+        data = parse_document(content, path)
+    write_snapshot(snapshot_file, {
+        "version": _SNAPSHOT_VERSION,
+        "mtime": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "hash": content_hash,
+        "data": data,
+    })
+    return data
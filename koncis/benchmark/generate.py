@@ -0,0 +1,178 @@
+#! /usr/bin/env python
+'''
+This application will generate synthetic Spark-style schemas, schema diffs and
+matching NDJSON fixtures for benchmarks.
+
+Usage:
+    generate.py (-h | --help)
+    generate.py [--width=<N>] [--depth=<N>] [--array-ratio=<R>] [--new-fields=<N>] [--lines=<N>] [--seed=<SEED>] <output_dir>
+
+Options:
+    -h, --help              Print this screen and exit.
+    --width=<N>             Number of fields on each struct level.
+                            [default: 100]
+    --depth=<N>             Max nesting depth of structs and arrays of structs.
+                            [default: 2]
+    --array-ratio=<R>       Ratio of nested fields which are arrays of structs, the other
+                            nested fields are structs.
+                            [default: 0.5]
+    --new-fields=<N>        Number of new leaf fields in the new schema version.
+                            [default: 10]
+    --lines=<N>             Number of fixture lines.
+                            [default: 1000]
+    --seed=<SEED>           Random seed of the generator.
+                            [default: 1]
+    <output_dir>            The directory to write new.yaml, old.yaml, diff.yaml and fixture.txt.
+'''
+
+from docopt import docopt
+import os
+import sys
+import copy
+import json
+import random
+import logging
+
+import yaml
+
+# the automation scripts are imported as modules
+AUTOMATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "automation")
+sys.path.insert(0, AUTOMATION_DIR)
+import schema_subtract
+
+_LOGGER     = logging.getLogger('generate.py')
+
+POD_TYPES   = ["string", "long", "integer", "double", "boolean", "timestamp"]
+# ratio of nested fields on each struct level above the max depth
+NESTED_RATIO = 0.1
+
+
+def pod_field(name, rng):
+    if rng.random() < 0.1:
+        return {"metadata": {}, "name": name, "nullable": True,
+                "type": {"containsNull": True, "elementType": rng.choice(POD_TYPES), "type": "array"}}
+    return {"metadata": {}, "name": name, "nullable": True, "type": rng.choice(POD_TYPES)}
+
+def struct_fields(prefix, width, depth, array_ratio, rng):
+    fields = []
+    for i in range(width):
+        name = f"{prefix}f{i}"
+        if depth > 0 and rng.random() < NESTED_RATIO:
+            struct = {"type": "struct", "fields": struct_fields(f"{name}_", width, depth - 1, array_ratio, rng)}
+            if rng.random() < array_ratio:
+                field_type = {"containsNull": True, "elementType": struct, "type": "array"}
+            else:
+                field_type = struct
+            fields.append({"metadata": {}, "name": name, "nullable": True, "type": field_type})
+        else:
+            fields.append(pod_field(name, rng))
+    return fields
+
+def generate_schema(width, depth, array_ratio=0.5, seed=1):
+    """
+    Generate a Spark-style struct schema, every struct level has width fields and
+    nested structs or arrays of structs go down to depth levels.
+    """
+    rng = random.Random(seed)
+    return {"type": "struct", "fields": struct_fields("", width, depth, array_ratio, rng)}
+
+def nested_structs(schema):
+    # all struct nodes of the schema, including the top level
+    structs = [schema]
+    for field in schema["fields"]:
+        field_type = field["type"]
+        if isinstance(field_type, dict):
+            struct = field_type.get("elementType", field_type)
+            if isinstance(struct, dict) and struct.get("type") == "struct":
+                structs.extend(nested_structs(struct))
+    return structs
+
+def sample_data(field_type, rng):
+    if field_type == "string" or field_type == "timestamp":
+        return [f"sample-{rng.randrange(1000)}" for _ in range(3)]
+    if field_type == "double":
+        return [rng.random() for _ in range(3)]
+    if field_type == "boolean":
+        return [True, False]
+    return [rng.randrange(1000) for _ in range(3)]
+
+def generate_new_version(old_schema, new_fields, seed=1):
+    """
+    Generate a new schema version by adding new_fields leaf fields to random struct
+    levels of old_schema, the new fields carry target_name, source_exp and sample_data.
+    """
+    rng = random.Random(seed)
+    new_schema = copy.deepcopy(old_schema)
+    structs = nested_structs(new_schema)
+    for i in range(new_fields):
+        struct = rng.choice(structs)
+        field_type = rng.choice(POD_TYPES)
+        name = f"new_field_{i}"
+        struct["fields"].append({
+            "metadata": {}, "name": name, "nullable": True, "type": field_type,
+            "source_exp": name, "target_name": name, "sample_data": sample_data(field_type, rng),
+        })
+    return new_schema
+
+def fixture_value(field, rng):
+    field_type = field["type"]
+    if isinstance(field_type, dict):
+        if "elementType" in field_type:
+            element = field_type["elementType"]
+            if isinstance(element, dict):
+                return [fixture_object(element, rng) for _ in range(rng.randrange(3))]
+            return [fixture_value({"type": element}, rng) for _ in range(rng.randrange(3))]
+        return fixture_object(field_type, rng)
+    if field_type == "string" or field_type == "timestamp":
+        return f"value-{rng.randrange(100000)}"
+    if field_type == "double":
+        return rng.random()
+    if field_type == "boolean":
+        return rng.random() < 0.5
+    return rng.randrange(1 << 31)
+
+def fixture_object(struct, rng):
+    return {field["name"]: fixture_value(field, rng) for field in struct["fields"]}
+
+def generate_fixture_lines(schema, lines, seed=1):
+    """
+    Generate NDJSON fixture lines matching the schema.
+    """
+    rng = random.Random(seed)
+    for _ in range(lines):
+        yield f"{json.dumps(fixture_object(schema, rng), sort_keys=True)}\n"
+
+def generate_sqlddl(columns):
+    """
+    Generate a SQL DDL template with the given number of columns.
+    """
+    column_defs = [f"col_{i} {'decimal(14, 5)' if i % 5 == 0 else 'string'}" for i in range(columns)]
+    column_defs.append("txn_time timestamp")
+    return ("CREATE TABLE IF NOT EXISTS ?table? (\n    "
+            + ",\n    ".join(column_defs)
+            + "\n)\nUSING iceberg\nPARTITIONED BY (hours(txn_time), bucket(?bucket_num?, col_1))\n")
+
+
+def main(args):
+    logging.basicConfig(
+        format='%(asctime)s %(name)s[%(levelname)s]: %(message)s',
+        level=logging.INFO
+    )
+    output_dir = args["<output_dir>"]
+    seed = int(args["--seed"])
+    old_schema = generate_schema(int(args["--width"]), int(args["--depth"]), float(args["--array-ratio"]), seed)
+    new_schema = generate_new_version(old_schema, int(args["--new-fields"]), seed)
+    diff_schema = schema_subtract.schema_subtract(new_schema, old_schema)
+
+    os.makedirs(output_dir, exist_ok=True)
+    for name, schema in (("old.yaml", old_schema), ("new.yaml", new_schema), ("diff.yaml", diff_schema)):
+        with open(os.path.join(output_dir, name), "w") as f:
+            yaml.dump(schema, f, sort_keys=False)
+    with open(os.path.join(output_dir, "fixture.txt"), "w") as f:
+        f.writelines(generate_fixture_lines(old_schema, int(args["--lines"]), seed))
+    _LOGGER.info(f"Generated benchmark data in {output_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(docopt(__doc__)))
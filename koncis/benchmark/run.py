@@ -0,0 +1,194 @@
+#! /usr/bin/env python
+'''
+This application will run the benchmark suite of the automation hot paths across
+size tiers, and write the results as JSON.
+
+Usage:
+    run.py (-h | --help)
+    run.py [--tiers=<tiers>] [--repeat=<N>] [--output=<output_file>] [--baseline=<baseline_file>]
+
+Options:
+    -h, --help                      Print this screen and exit.
+    --tiers=<tiers>                 Comma separated size tiers to run, supported tiers are
+                                    small, medium and large.
+                                    [default: small,medium]
+    --repeat=<N>                    Number of timed runs of each benchmark, the min and median
+                                    wall time are reported.
+                                    [default: 5]
+    --output=<output_file>          Specify the JSON file to write results, print to stdout if
+                                    it isn't given.
+    --baseline=<baseline_file>      Compare with the results of a previous run, the ratio of
+                                    min wall time to the baseline is reported.
+'''
+
+from docopt import docopt
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import tempfile
+import statistics
+
+import generate
+import propagate
+import schema_subtract
+import show
+
+_LOGGER     = logging.getLogger('run.py')
+
+# size tier name to the parameters of synthetic data
+TIERS = {
+    "small":    {"width": 50,  "depth": 1, "new_fields": 5,  "lines": 1000,   "columns": 100,  "schemas": 10},
+    "medium":   {"width": 200, "depth": 2, "new_fields": 20, "lines": 10000,  "columns": 500,  "schemas": 100},
+    "large":    {"width": 500, "depth": 2, "new_fields": 50, "lines": 100000, "columns": 2000, "schemas": 1000},
+}
+
+
+def timeit(func, repeat, setup=None):
+    """
+    Run func repeat times, setup is run before each run and isn't timed.
+    return:
+        A list of wall time in seconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def bench_list_leaf(params, repeat, work_dir):
+    old_schema = generate.generate_schema(params["width"], params["depth"])
+    new_schema = generate.generate_new_version(old_schema, params["new_fields"])
+    # a fresh schema object in every run, don't measure caches keyed by identity
+    return timeit(lambda: propagate.list_leaf({**new_schema}), repeat)
+
+def bench_schema_subtract(params, repeat, work_dir):
+    old_schema = generate.generate_schema(params["width"], params["depth"])
+    new_schema = generate.generate_new_version(old_schema, params["new_fields"])
+    return timeit(lambda: schema_subtract.schema_subtract(new_schema, old_schema), repeat)
+
+def bench_modify_fixture(params, repeat, work_dir):
+    old_schema = generate.generate_schema(params["width"], params["depth"])
+    new_schema = generate.generate_new_version(old_schema, params["new_fields"])
+    schema_diff = schema_subtract.schema_subtract(new_schema, old_schema)
+    origin_file = os.path.join(work_dir, "fixture.orig.txt")
+    fixture_file = os.path.join(work_dir, "fixture.txt")
+    with open(origin_file, "w") as f:
+        f.writelines(generate.generate_fixture_lines(old_schema, params["lines"]))
+
+    def setup():
+        shutil.copyfile(origin_file, fixture_file)
+
+    def run():
+        # compile the plan in every run, as the cli does
+        plan = propagate.compile_insertion_plan({**schema_diff})
+        propagate.apply_fixture(f"{fixture_file}::", plan, seed=1)
+    return timeit(run, repeat, setup)
+
+def bench_extract_columns(params, repeat, work_dir):
+    ddl = generate.generate_sqlddl(params["columns"])
+
+    def run():
+        # don't measure the per template cache
+        propagate.tokenize_sqlddl_columns.cache_clear()
+        propagate.extract_columns_from_sqlddl(ddl)
+    return timeit(run, repeat)
+
+def bench_show_lookup(params, repeat, work_dir):
+    schema_config = {"schemas": [
+        {"name": f"schema-{i}", "file": f"automation/schemas/schema-{i}.yaml",
+         "col_files": [f"columns/{i}.json"], "col_mappings": None,
+         "iceberg_table_schemas": [{"file": f"sql/{i}.template", "col_suffix": "_at_x", "prod_tables": [f"lena.t{i}"]}],
+         "ci_fixture": [f"ci/{i}.txt"], "ci_fixture_derived": None, "litepipes": None}
+        for i in range(params["schemas"])
+    ]}
+    schema_paths = [conf["file"] for conf in schema_config["schemas"]]
+
+    def run():
+        # a fresh config object, the index of the last config is cached
+        config = {"schemas": list(schema_config["schemas"])}
+        show.build_manifest(config, schema_paths)
+    return timeit(run, repeat)
+
+# benchmark name to function, which accepts tier params, repeat and a work directory
+BENCHMARKS = {
+    "list_leaf":                    bench_list_leaf,
+    "schema_subtract":              bench_schema_subtract,
+    "modify_fixture":               bench_modify_fixture,
+    "extract_columns_from_sqlddl":  bench_extract_columns,
+    "show_lookup":                  bench_show_lookup,
+}
+
+def run_suite(tiers, repeat):
+    results = []
+    for tier in tiers:
+        params = TIERS[tier]
+        for name, bench in BENCHMARKS.items():
+            work_dir = tempfile.mkdtemp(prefix=f"koncis-bench-{name}-")
+            try:
+                timings = bench(params, repeat, work_dir)
+            finally:
+                shutil.rmtree(work_dir)
+            result = {
+                "name": name,
+                "tier": tier,
+                "params": params,
+                "repeat": repeat,
+                "min_s": min(timings),
+                "median_s": statistics.median(timings),
+            }
+            _LOGGER.info(f"{name}[{tier}]: min {result['min_s']:.6f}s, median {result['median_s']:.6f}s")
+            results.append(result)
+    return results
+
+def compare_baseline(results, baseline):
+    baseline_results = {(r["name"], r["tier"]): r for r in baseline["results"]}
+    for result in results:
+        base = baseline_results.get((result["name"], result["tier"]))
+        if base is None or base["min_s"] == 0:
+            continue
+        result["baseline_ratio"] = result["min_s"] / base["min_s"]
+        _LOGGER.info(f"{result['name']}[{result['tier']}]: {result['baseline_ratio']:.2f}x of baseline")
+
+
+def main(args):
+    logging.basicConfig(
+        format='%(asctime)s %(name)s[%(levelname)s]: %(message)s',
+        level=logging.INFO
+    )
+    tiers = args["--tiers"].split(",")
+    for tier in tiers:
+        if tier not in TIERS:
+            _LOGGER.error(f"Unsupported tier {tier}, it should be one of {list(TIERS)}")
+            return 1
+    # per item logging of the automation scripts would dominate the timings
+    for name in ("propagate.py", "schema_subtract.py", "show.py"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    results = run_suite(tiers, int(args["--repeat"]))
+    if args["--baseline"]:
+        with open(args["--baseline"]) as f:
+            compare_baseline(results, json.load(f))
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args["--output"]:
+        with open(args["--output"], "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    else:
+        print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(docopt(__doc__)))